@@ -7,4 +7,4 @@ echo
 git push <path to hub repository> master
 
 echo "starting website rendering, have a look at gitwig.log"
-nohup gitwig-update > gitiwg.log 2>&1 &
+nohup gitwig -C <path to live repository> -v notify > gitwig.log 2>&1 &
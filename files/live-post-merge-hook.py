@@ -3,4 +3,4 @@
 # To enable this hook, rename this file to "post-merge".
 
 echo "starting website rendering, have a look at gitwig.log"
-nohup gitwig-update > gitiwg.log 2>&1 &
+nohup gitwig -C <path to live repository> -v notify > gitwig.log 2>&1 &
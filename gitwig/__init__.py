@@ -1,9 +1,6 @@
-""" Classes and function to render a static blog with support of git """
+""" Classes and function to render a static blog with support of git 
 
-from . import cache
-from . import common
-from . import content
-from . import deploy
-from . import inbox
-from . import renderset
-from . import settings
+the submodules are not imported here, since some of them depend on heavy 
+packages like genshi or GitPython. import the needed modules directly, e.g.
+"from gitwig import deploy" or use the gitwig command, see gitwig.cli
+"""
@@ -1,6 +1,16 @@
-""" Caching of blog post headers and creation of indices for dates and tags """
+""" Caching of blog post headers and creation of indices for dates and tags
+
+the cache is stored in a directory: the blog posts are sharded by the year 
+they were created, a global index file holds a summary of every blog post and 
+the precomputed indices. loading the cache only reads the global index, the
+shards are loaded when a blog post in them is needed.
+"""
 
 # global imports
+import bisect
+import collections
+import hashlib
+import heapq
 import os
 try:
     import cPickle as pickle
@@ -12,14 +22,55 @@ except ImportError:
 from . import common
 from . import content
 
+# file name of the global index in the cache directory
+INDEX_FILE_NAME = "index.pickle"
+# file name pattern of the shards in the cache directory
+SHARD_FILE_NAME = "posts-%s.pickle"
+
+# summary of a blog post, all the data needed for the indices and the sha of
+# the git blob it was read from
+PostSummary = collections.namedtuple("PostSummary", 
+                                     "created tags shard fingerprint digest "\
+                                     "blob")
+# summaries stored by older versions don't know the blob
+PostSummary.__new__.__defaults__ = (None,)
+
+
+def shard_key(blog_post):
+    """ returns the key of the shard a blog post is stored in """
+    return str(blog_post.headers["created"].year)
+
 
 class BlogCache(object):
     """ caches blog post headers and calculates indices for dates and tags """
 
     def __init__(self):
         """ initialization """
+        # blog posts in the loaded shards
         self.cache = dict()
+        # summaries of all blog posts by id
+        self.summaries = dict()
         self._reset_indices()
+        self._reset_related()
+        # if set, the bodies of blog posts are not stored in the cache
+        self.body_cache = None
+        # the sha of the last rendered git commit
+        self.commit = None
+        # fingerprints of the data displayed by the rendered indices
+        self.fingerprints = dict()
+        # last modification times of the static pages from the git history, 
+        # by path. blog posts keep them in their headers
+        self.page_times = dict()
+        # ids of blog posts that could not be read -> id of the old version
+        # of a renamed blog post kept online instead, or None
+        self.failed = dict()
+        # the cache directory to load shards from, not set for a new cache
+        self.cache_dir = None
+        self.loaded_shards = set()
+        self.dirty_shards = set()
+        # inode, modification time and size of the index file when it was
+        # last read or written, to notice changes by other processes
+        self.index_stat = None
         
     def _reset_indices(self):
         """ resets all related indices for dates and tags """
@@ -27,105 +78,470 @@ class BlogCache(object):
         self.months = dict()
         self.years = dict()
         self.tags = dict()
-        # this list is for presorting the ids of blog-posts
-        self.sorted_ids = list()
+        # (created, id) of all blog posts, the oldest first. it is kept sorted
+        # when blog posts are added or removed, the newest first list of ids 
+        # is created from it on access
+        self._order = list()
+        self._sorted_ids = list()
+        self._needs_sorting = False
+    
+    def _reset_related(self):
+        """ resets the table of related blog posts """
+        # maps a blog post id to a ranked list of related blog post ids
+        self.related = dict()
+    
+    @property
+    def sorted_ids(self):
+        """ the ids of all blog posts, the newest first """
+        if self._needs_sorting:
+            self._sorted_ids = [id for c, id in reversed(self._order)]
+            self._needs_sorting = False
+        return self._sorted_ids
+    
+    def neighbors(self, id):
+        """ returns the ids of the previous (older) and the next (newer) blog 
+        post, None if there is no such post
+        """
+        order = self._order
+        position = bisect.bisect_left(order, (self.summaries[id].created, id))
+        previous = order[position - 1][1] if position > 0 else None
+        next = order[position + 1][1] if position + 1 < len(order) else None
+        return previous, next
+    
+    def __contains__(self, id):
+        """ checks if a blog post is in the cache, loaded or not """
+        return id in self.summaries
+    
+    def get(self, id):
+        """ returns a blog post, loads its shard if necessary """
+        if id not in self.cache and id in self.summaries:
+            self._load_shard(self.summaries[id].shard)
+        return self.cache[id]
     
     def add(self, blog_post):
-        """ adds a blog post to the cache """
+        """ adds a blog post to the cache and updates the indices 
+        
+        an older version of the blog post must be removed first with pop
+        """
         common.log.debug("cache: adding blog post '%s'" % blog_post.id)
+        if self.body_cache is not None:
+            # a loaded body is kept in the body cache, so it is not read 
+            # again if the post is rendered soon
+            if blog_post.body is not None:
+                self.body_cache.put(blog_post.id, blog_post.body)
+            blog_post.body = None
+            blog_post.body_cache = self.body_cache
+        # the summary is created first, a post with broken headers will not
+        # change the cache
+        shard = shard_key(blog_post)
+        summary = self._summarize(blog_post, shard)
+        self._load_shard(shard)
+        self.dirty_shards.add(shard)
         self.cache[blog_post.id] = blog_post
+        self.summaries[blog_post.id] = summary
+        self.failed.pop(blog_post.id, None)
+        self._add_to_indices(blog_post.id)
+    
+    def _summarize(self, blog_post, shard):
+        """ returns the summary of a blog post """
+        headers = blog_post.headers
+        # ids read from git are unicode, from the file system not
+        displayed = (unicode(blog_post.id), headers["title"], 
+                     headers["created"], headers["updated"], 
+                     sorted(headers["tags"] or []), 
+                     blog_post.meta.get("excerpt"), 
+                     blog_post.meta.get("words"),
+                     blog_post.meta.get("reading_time"))
+        fingerprint = hashlib.md5(repr(displayed)).hexdigest()
+        return PostSummary(headers["created"], frozenset(headers["tags"]),
+                           shard, fingerprint, blog_post.meta.get("digest"),
+                           blog_post.meta.get("blob"))
+    
+    def use_body_cache(self, max_size):
+        """ drops the bodies of blog posts and loads them through a LRU cache
+        
+        max_size is the maximum number of characters held in the body cache
+        """
+        common.log.debug("cache: using a body cache of %d chars" % max_size)
+        self.body_cache = BodyCache(max_size)
+        for blog_post in self.cache.itervalues():
+            blog_post.body = None
+            blog_post.body_cache = self.body_cache
     
     def pop(self, id, default=None):
-        """ removes a blog post from the cache
+        """ removes a blog post from the cache and updates the indices
         
         if the blog post is not in the cache the default value (None) will be
         returned
         """
         common.log.debug("cache: removing blog post '%s'" % id)
-        return self.cache.pop(id, default)
+        summary = self.summaries.get(id)
+        if summary is None:
+            return default
+        self._load_shard(summary.shard)
+        self._remove_from_indices(id)
+        del self.summaries[id]
+        self.dirty_shards.add(summary.shard)
+        return self.cache.pop(id)
+    
+    def blobs(self):
+        """ returns a dict of the git blob shas of all blog posts by id """
+        return dict( (id, s.blob) for id, s in self.summaries.iteritems() )
+    
+    def drop_shard(self, shard):
+        """ removes all blog posts of a shard without loading it 
+        
+        used for a shard that could not be loaded, the removed blog posts 
+        should be added again by a reconciliation with the git repository
+        """
+        common.log.warn("cache: dropping shard '%s'" % shard)
+        for id, summary in self.summaries.items():
+            if summary.shard == shard:
+                self._remove_from_indices(id)
+                del self.summaries[id]
+                self.related.pop(id, None)
+                self.cache.pop(id, None)
+        # an empty shard is written, if no blog post is added again
+        self.loaded_shards.add(shard)
+        self.dirty_shards.add(shard)
     
     def build_indices(self):
-        """ builds the indices for dates and tags from the cache """
+        """ builds the indices for dates and tags from the post summaries 
+        
+        the indices are updated with every added or removed blog post, this 
+        is only needed to repair them
+        """
         common.log.debug("cache: building indices ...")
         self._reset_indices()
-        # temporary list, used later for presorting blog posts
-        unsorted = list()
-        for id, blog_post in self.cache.iteritems():
-            # the ids for day, month and year are tuples with the corresponding
-            # values retrieved from the 'created' header of a blog post
-            date_tuple = common.date_tuple(blog_post)
-            self.days.setdefault(date_tuple, set()).add(id)
-            self.months.setdefault(date_tuple[:2], set()).add(id)
-            self.years.setdefault(date_tuple[:1], set()).add(id)
-            for tag in blog_post.headers["tags"]:
-                self.tags.setdefault(tag, set()).add(id)
-            # we append a tuple consisting of the 'created' header of the blog 
-            # post and its id to the temporary list for presorting the posts
-            unsorted.append( (blog_post.headers["created"], id) )
-        # tuple sorting is used to create the final list of presorted blog posts
-        self.sorted_ids = [id for created, id in sorted(unsorted, reverse=True)]
+        for id in self.summaries:
+            self._add_to_indices(id)
         common.log.debug("cache: ... done")
+    
+    def _date_index_ids(self, id):
+        """ returns the ids of the day, month and year index of a blog post """
+        created = self.summaries[id].created
+        # the ids for day, month and year are tuples with the corresponding
+        # values retrieved from the 'created' header of a blog post
+        date_tuple = (created.year, created.month, created.day)
+        return date_tuple, date_tuple[:2], date_tuple[:1]
+    
+    def _add_to_indices(self, id):
+        """ adds a blog post to the date and tag indices """
+        day, month, year = self._date_index_ids(id)
+        self.days.setdefault(day, set()).add(id)
+        self.months.setdefault(month, set()).add(id)
+        self.years.setdefault(year, set()).add(id)
+        for tag in self.summaries[id].tags:
+            self.tags.setdefault(tag, set()).add(id)
+        bisect.insort(self._order, (self.summaries[id].created, id))
+        self._needs_sorting = True
+    
+    def _remove_from_indices(self, id):
+        """ removes a blog post from the date and tag indices 
+        
+        empty indices are removed
+        """
+        day, month, year = self._date_index_ids(id)
+        index_ids = [(self.days, day), (self.months, month), 
+                     (self.years, year)]
+        index_ids.extend( (self.tags, tag) for tag in 
+                          self.summaries[id].tags )
+        for index, index_id in index_ids:
+            index[index_id].discard(id)
+            if not index[index_id]:
+                del index[index_id]
+        key = (self.summaries[id].created, id)
+        position = bisect.bisect_left(self._order, key)
+        if position < len(self._order) and self._order[position] == key:
+            del self._order[position]
+        self._needs_sorting = True
             
+    def sort_ids(self, post_ids):
+        """ returns a list of blog post ids, the newest first """
+        return [pid for pid in self.sorted_ids if pid in post_ids]
+    
     def posts_by_id_list(self, post_ids):
         """ returns a sorted list of blog posts by their ids """
         common.log.debug("cache: listing %d posts by id" % len(post_ids))
-        sorted_post_ids = (pid for pid in self.sorted_ids if pid in post_ids)
-        return (self.cache[post_id] for post_id in sorted_post_ids)
+        return (self.get(post_id) for post_id in self.sort_ids(post_ids))
+    
+    def latest_ids(self, post_ids, number_of_posts):
+        """ returns the ids of the latest of some blog posts, the newest first
+        
+        the posts are not looked up in the sorted list of all posts, so this
+        is cheap for a small number of ids
+        """
+        keys = heapq.nlargest(number_of_posts, 
+                              ( (self.summaries[id].created, id) 
+                                for id in post_ids ))
+        return [id for created, id in keys]
     
     def get_latest(self, number_of_posts):
         """ returns the latest blog posts in the cache"""
         common.log.debug("cache: listing the latest %d posts" % number_of_posts)
         return self.posts_by_id_list(self.sorted_ids[:number_of_posts])
     
+    def get_related(self, id):
+        """ returns the related blog posts of a blog post, best match first """
+        return (self.get(pid) for pid in self.related.get(id, []))
+    
+    def build_related(self, number_of_posts):
+        """ builds the table of related blog posts for all cached posts """
+        common.log.debug("cache: building related posts ...")
+        self._reset_related()
+        self.update_related(self.summaries, number_of_posts)
+        common.log.debug("cache: ... done")
+    
+    def update_related(self, post_ids, number_of_posts):
+        """ recalculates the related blog posts of the given blog post ids
+        
+        ids no longer in the cache are removed from the table. returns a set 
+        of the ids of all blog posts whose list of related posts has changed.
+        """
+        # the position in the presorted list is used as a tie breaker, 
+        # newer blog posts are ranked higher
+        positions = dict( (id, i) for i, id in enumerate(self.sorted_ids) )
+        changed = set()
+        for id in post_ids:
+            if id not in self.summaries:
+                if self.related.pop(id, None) is not None:
+                    changed.add(id)
+                continue
+            related = self._rank_related(id, number_of_posts, positions)
+            if self.related.get(id) != related:
+                self.related[id] = related
+                changed.add(id)
+        return changed
+    
+    def _rank_related(self, id, number_of_posts, positions):
+        """ returns the ids of the related posts by overlap of the tags """
+        overlap = dict()
+        for tag in self.summaries[id].tags:
+            for other_id in self.tags.get(tag, ()):
+                overlap[other_id] = overlap.get(other_id, 0) + 1
+        overlap.pop(id, None)
+        ranked = sorted(overlap, key=lambda o: (-overlap[o], positions[o]))
+        return ranked[:number_of_posts]
+    
+    def related_candidates(self, tags):
+        """ returns the ids of all blog posts that are tagged with any tag """
+        candidates = set()
+        for tag in tags:
+            candidates.update(self.tags.get(tag, ()))
+        return candidates
+    
+    def post_fingerprint(self, id, with_body=False):
+        """ returns the fingerprint of the displayed data of a blog post 
+        
+        if with_body is set, the digest of the body is included
+        """
+        summary = self.summaries[id]
+        if with_body:
+            return (summary.fingerprint, summary.digest)
+        return summary.fingerprint
+    
+    def changed_fingerprint(self, index, with_body=None):
+        """ returns the fingerprint of an index, or None if it is the stored
+        one
+        
+        the fingerprint is stored with set_fingerprint once the index is 
+        rendered. with_body is passed to the fingerprint method of the index
+        """
+        fingerprint = index.fingerprint(self, with_body)
+        if self.fingerprints.get( (type(index).__name__, index.id) ) == \
+           fingerprint:
+            return None
+        return fingerprint
+    
+    def set_fingerprint(self, index, fingerprint):
+        """ stores the fingerprint of a rendered index """
+        self.fingerprints[ (type(index).__name__, index.id) ] = fingerprint
+    
+    def drop_fingerprint(self, index):
+        """ removes the fingerprint of an index """
+        self.fingerprints.pop( (type(index).__name__, index.id), None)
+    
     def get_tag_count(self):
         """ returns a sorted list of tags from blog posts and their count """
         return sorted( (id, len(posts)) for id, posts in self.tags.iteritems() )
+    
+    def get_month_count(self):
+        """ returns a list of months from blog posts and their count, the 
+        newest first 
+        """
+        return sorted( ((id, len(posts)) for id, posts 
+                       in self.months.iteritems()), reverse=True )
 
-    def write(self, cache_path):
-        """ writes a version of the cache to a specified file """
-        common.log.info("cache: writing cache to '%s' ..." % cache_path)
-        items = [ (id, post.headers) for id, post in self.cache.iteritems() ]
-        file_handle = open(cache_path, "wb")
-        pickle.dump(items, file_handle, pickle.HIGHEST_PROTOCOL)
+    def write(self, cache_dir):
+        """ writes the global index and the changed shards to a directory """
+        common.log.info("cache: writing cache to '%s' ..." % cache_dir)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        shards = dict( (shard, list()) for shard in self.dirty_shards )
+        for id, blog_post in self.cache.iteritems():
+            shard = self.summaries[id].shard
+            if shard in shards:
+                shards[shard].append( (id, blog_post.headers, blog_post.meta) )
+        for shard, items in shards.iteritems():
+            shard_path = os.path.join(cache_dir, SHARD_FILE_NAME % shard)
+            if items:
+                self._dump(items, shard_path)
+            elif os.path.isfile(shard_path):
+                os.remove(shard_path)
+        if self.cache_dir is None:
+            # a new cache, remove the shards of a former cache
+            written = set(SHARD_FILE_NAME % shard for shard in shards)
+            for file_name in os.listdir(cache_dir):
+                if file_name.startswith("posts-") and file_name not in written:
+                    os.remove(os.path.join(cache_dir, file_name))
+        data = {
+            "summaries": self.summaries,
+            "days": self.days,
+            "months": self.months,
+            "years": self.years,
+            "tags": self.tags,
+            "sorted_ids": self.sorted_ids,
+            "related": self.related,
+            "commit": self.commit,
+            "fingerprints": self.fingerprints,
+            "page_times": self.page_times,
+            "failed": self.failed }
+        index_path = os.path.join(cache_dir, INDEX_FILE_NAME)
+        self._dump(data, index_path)
+        self.index_stat = self._index_stat(index_path)
+        common.log.info("cache: ... %d shards written" % len(shards))
+        self.cache_dir = cache_dir
+        self.loaded_shards.update(shards)
+        self.dirty_shards = set()
+    
+    def _dump(self, data, path):
+        """ pickles data to a file """
+        common.break_hard_link(path)
+        file_handle = open(path, "wb")
+        pickle.dump(data, file_handle, pickle.HIGHEST_PROTOCOL)
         file_handle.close()
-        common.log.info("cache: ... done")
 
-    def load(self, cache_path):
-        """ loads the cache from a given file path
+    def load(self, cache_dir):
+        """ loads the global index of the cache from a given directory
         
         will raise a gitwig.common.NeedsRebuildError if the file could not be
-        opened or the data could not be unpickled
+        opened, the data could not be unpickled or is in an outdated format
         """
         try:
-            common.log.info("cache: loading cache from '%s' ..." % cache_path)
-            file_handle = open(cache_path, "rb")
+            index_path = os.path.join(cache_dir, INDEX_FILE_NAME)
+            common.log.info("cache: loading cache from '%s' ..." % index_path)
+            file_handle = open(index_path, "rb")
             self.read(file_handle)
             file_handle.close()
+            self.cache_dir = cache_dir
+            self.index_stat = self._index_stat(index_path)
             common.log.info("cache: ... done")
-        except (IOError, pickle.PickleError):
+        except (IOError, KeyError, TypeError, ValueError, pickle.PickleError):
             raise common.NeedsRebuildError("could not load cache from '%s'" %\
-                                           cache_path)
+                                           cache_dir)
+    
+    def _index_stat(self, index_path):
+        """ returns the data compared by is_stale or None """
+        try:
+            stat = os.stat(index_path)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime, stat.st_size)
+    
+    def is_stale(self, cache_dir):
+        """ checks if the stored cache in a directory was written by another 
+        process since this cache was read or written
+        """
+        index_stat = self._index_stat(os.path.join(cache_dir, 
+                                                   INDEX_FILE_NAME))
+        return index_stat is None or index_stat != self.index_stat
     
     def read(self, file_handle):
-        """ reads the cache from a given file like object """
+        """ reads the global index of the cache from a file like object """
         common.log.debug("cache: reading ...")
-        items = pickle.load(file_handle)
+        data = pickle.load(file_handle)
         file_handle.close()
-        for id, headers in items:
-            self.cache[id] = content.BlogPost(id, headers)
-        self.build_indices()
+        self.summaries = data["summaries"]
+        self.days = data["days"]
+        self.months = data["months"]
+        self.years = data["years"]
+        self.tags = data["tags"]
+        self._sorted_ids = data["sorted_ids"]
+        self._order = [ (self.summaries[id].created, id) 
+                        for id in reversed(self._sorted_ids) ]
+        self._needs_sorting = False
+        self.related = data["related"]
+        self.commit = data["commit"]
+        self.fingerprints = data["fingerprints"]
+        self.page_times = data["page_times"]
+        self.failed = data["failed"]
         common.log.debug("cache: ... done")
     
+    def _load_shard(self, shard):
+        """ loads the blog posts of a shard, if not already done 
+        
+        will raise a gitwig.common.CacheDriftError if the shard could not be
+        loaded
+        """
+        if self.cache_dir is None or shard in self.loaded_shards:
+            return
+        shard_path = os.path.join(self.cache_dir, SHARD_FILE_NAME % shard)
+        self.loaded_shards.add(shard)
+        if not os.path.isfile(shard_path):
+            # a new shard
+            return
+        common.log.debug("cache: loading shard '%s'" % shard_path)
+        try:
+            file_handle = open(shard_path, "rb")
+            items = pickle.load(file_handle)
+            file_handle.close()
+        except (IOError, EOFError, ValueError, pickle.PickleError):
+            raise common.CacheDriftError("could not load shard '%s'" %\
+                                         shard_path, shard)
+        for id, headers, meta in items:
+            # removed, changed or moved blog posts are not loaded again
+            summary = self.summaries.get(id)
+            if summary and summary.shard == shard and id not in self.cache:
+                blog_post = content.BlogPost(id, headers, meta)
+                if self.body_cache is not None:
+                    blog_post.body_cache = self.body_cache
+                self.cache[id] = blog_post
+    
     @classmethod
-    def from_file(cls, cache_path):
-        """ returns an instance and loads the cache from file in one go """
+    def from_file(cls, cache_dir):
+        """ returns an instance and loads the cache from a directory """
         instance = cls()
-        instance.load(cache_path)
+        instance.load(cache_dir)
         return instance
 
-    @classmethod
-    def from_handle(cls, file_handle):
-        """ returns an instance and loads the cache from a file like object """
-        instance = cls()
-        instance.read(file_handle)
-        return instance
+
+class BodyCache(object):
+    """ size bounded least recently used cache for bodies of content items """
+
+    def __init__(self, max_size):
+        """ initialization, max_size is the number of characters to hold """
+        self.max_size = max_size
+        self.size = 0
+        self.bodies = collections.OrderedDict()
+
+    def get_body(self, item):
+        """ returns the body of a content item, loads it if necessary """
+        body = self.bodies.get(item.id)
+        if body is None:
+            common.log.debug("cache: loading body of '%s'" % item.id)
+            item.load_body(item.id)
+            body, item.body = item.body, None
+        self.put(item.id, body)
+        return body
+
+    def put(self, id, body):
+        """ stores a body as the most recently used one """
+        old_body = self.bodies.pop(id, None)
+        if old_body is not None:
+            self.size -= len(old_body)
+        # the most recently used body is stored at the end
+        self.bodies[id] = body
+        self.size += len(body)
+        while self.size > self.max_size and len(self.bodies) > 1:
+            old_id, old_body = self.bodies.popitem(last=False)
+            self.size -= len(old_body)
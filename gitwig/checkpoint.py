@@ -0,0 +1,117 @@
+""" checkpoints of a rebuild, so an interrupted or failed rebuild can resume
+
+a checkpoint directory holds the partial blog cache, the keys of the items
+already rendered and the state of the link graph, the media fingerprints and
+the page tree.
+a rebuild of the same git commit resumes from the checkpoint: blog posts in
+the cache are not read again and rendered items are skipped. when the rebuild
+is done, the cache in the checkpoint replaces the cache directory.
+"""
+
+# global imports
+import os
+import shutil
+try:
+    import cPickle as pickle
+except ImportError:
+    # fallback
+    import pickle
+
+# local imports
+from . import cache
+from . import common
+
+STATE_FILE_NAME = "state.pickle"
+CACHE_DIR_NAME = "cache"
+LINKS_FILE_NAME = "links.pickle"
+MEDIA_FILE_NAME = "media.pickle"
+PAGE_TREE_FILE_NAME = "pagetree.pickle"
+
+
+class Checkpoint(object):
+    """ writes and restores the checkpoints of a rebuild """
+
+    def __init__(self, config):
+        """ initialization """
+        self.config = config
+        self.checkpoint_dir = config.checkpoint_dir
+        self.cache_dir = os.path.join(self.checkpoint_dir, CACHE_DIR_NAME)
+
+    def resume(self, commit, link_graph=None, media=None, page_tree=None):
+        """ returns the cache and the keys of the rendered items of a
+        checkpoint for a commit
+
+        if there is no usable checkpoint, a new cache and an empty set are
+        returned and an old checkpoint is removed. the state of the link
+        graph, the media fingerprints and the page tree is restored, if they
+        are given.
+        """
+        try:
+            file_handle = open(os.path.join(self.checkpoint_dir,
+                                            STATE_FILE_NAME), "rb")
+            state = pickle.load(file_handle)
+            file_handle.close()
+            if commit is None or state["commit"] != commit:
+                raise ValueError("checkpoint of another commit")
+            tmp_cache = cache.BlogCache.from_file(self.cache_dir)
+            if link_graph is not None:
+                link_graph.load(os.path.join(self.checkpoint_dir,
+                                             LINKS_FILE_NAME))
+            if media is not None:
+                media.load(os.path.join(self.checkpoint_dir, MEDIA_FILE_NAME))
+            if page_tree is not None:
+                page_tree.load(os.path.join(self.checkpoint_dir,
+                                            PAGE_TREE_FILE_NAME))
+        except (IOError, EOFError, KeyError, ValueError, pickle.PickleError,
+                common.NeedsRebuildError):
+            self.remove()
+            if link_graph is not None:
+                link_graph.begin_run(rebuild=True)
+            if media is not None:
+                media.begin_run(rebuild=True)
+            if page_tree is not None:
+                page_tree.begin_run(rebuild=True)
+            tmp_cache = cache.BlogCache()
+            tmp_cache.commit = commit
+            return tmp_cache, set()
+        common.log.warn("checkpoint: resuming the rebuild, %d blog posts and"\
+                        " %d items done" % (len(tmp_cache.summaries),
+                                            len(state["done"])))
+        return tmp_cache, state["done"]
+
+    def write(self, tmp_cache, done, link_graph=None, media=None,
+              page_tree=None):
+        """ writes a checkpoint """
+        common.log.info("checkpoint: writing, %d items done" % len(done))
+        tmp_cache.write(self.cache_dir)
+        if link_graph is not None:
+            link_graph.write(os.path.join(self.checkpoint_dir,
+                                          LINKS_FILE_NAME))
+        if media is not None:
+            media.write(os.path.join(self.checkpoint_dir, MEDIA_FILE_NAME))
+        if page_tree is not None:
+            page_tree.write(os.path.join(self.checkpoint_dir,
+                                         PAGE_TREE_FILE_NAME))
+        # the state is written last, it marks a complete checkpoint
+        state = {"commit": tmp_cache.commit, "done": done}
+        file_handle = open(os.path.join(self.checkpoint_dir,
+                                        STATE_FILE_NAME), "wb")
+        pickle.dump(state, file_handle, pickle.HIGHEST_PROTOCOL)
+        file_handle.close()
+
+    def finish(self, tmp_cache):
+        """ writes the cache, moves it to the cache dir and removes the
+        checkpoint
+        """
+        tmp_cache.write(self.cache_dir)
+        if os.path.isdir(self.config.cache_dir):
+            shutil.rmtree(self.config.cache_dir)
+        os.rename(self.cache_dir, self.config.cache_dir)
+        tmp_cache.cache_dir = self.config.cache_dir
+        self.remove()
+
+    def remove(self):
+        """ removes the checkpoint directory """
+        if os.path.isdir(self.checkpoint_dir):
+            common.log.info("checkpoint: removing '%s'" % self.checkpoint_dir)
+            shutil.rmtree(self.checkpoint_dir)
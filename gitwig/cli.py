@@ -0,0 +1,303 @@
+""" the gitwig command line interface
+
+usage: gitwig [-C directory] [-c config] [-v] [-t] 
+              {update,rebuild,publish-due,plan,preview,retag,inbox,serve,apply,
+               daemon,notify}
+
+the heavy dependencies like genshi, GitPython and markdown are only imported
+by the subcommands that need them. use the -t option to log the startup time
+of a subcommand.
+"""
+
+# global imports
+import time
+# the start of the cold start measurement, as early as possible
+_start_time = time.time()
+import argparse
+import locale
+import os
+import subprocess
+import sys
+
+# local imports
+from . import common
+
+
+def load_settings(args):
+    """ changes to the site directory and loads the settings """
+    from . import settings
+    os.chdir(args.directory)
+    config = settings.Settings.from_file(args.config)
+    if config.locale:
+        locale.setlocale(locale.LC_ALL, config.locale)
+    return config
+
+def build_workflow(config):
+    """ returns a workflow with markdown conversion and genshi templating """
+    import markdown
+    from . import deploy
+    md_instance = markdown.Markdown(config.markdown_extensions)
+    highlight_cache = None
+    if config.highlight_cache_path:
+        from . import highlight
+        highlight_cache = highlight.HighlightCache.from_file(
+                                                config.highlight_cache_path,
+                                                config.highlight_cache_size)
+    # only the tag feeds show a blog post more than once
+    memo_size = config.conversion_memo_size if config.tag_feeds else 0
+    md_converter = deploy.MarkdownConverter(md_instance, highlight_cache,
+                                            config.highlight_cache_path,
+                                            memo_size)
+    link_graph = None
+    if config.link_check:
+        from . import links
+        link_graph = links.LinkGraph(config)
+    media_fingerprints = None
+    if config.media_fingerprints:
+        from . import media
+        media_fingerprints = media.MediaFingerprints(config)
+    delta_bundle = None
+    if config.delta_bundle:
+        from . import delta
+        delta_bundle = delta.DeltaBundle(config)
+    timings = None
+    if config.render_timings_path:
+        from . import plan
+        timings = plan.RenderTimings.from_file(config.render_timings_path)
+    page_tree = None
+    if config.page_tree:
+        from . import pagetree
+        page_tree = pagetree.PageTree(config)
+    templating = deploy.GenshiTemplating(config, link_graph, 
+                                         media_fingerprints)
+    rendering = deploy.Renderer(config, templating, md_converter, link_graph,
+                                page_tree)
+    return deploy.Workflow(config, rendering, md_converter, link_graph,
+                           media_fingerprints, delta_bundle, timings, 
+                           page_tree)
+
+def log_startup(args):
+    """ logs the time since the import of this module if requested """
+    if args.timing:
+        elapsed = (time.time() - _start_time) * 1000
+        common.log.warn("cli: '%s' started after %.1f ms" %\
+                        (args.command, elapsed))
+
+def cmd_update(args):
+    """ renders the changes since the last rendered commit """
+    config = load_settings(args)
+    worker = build_workflow(config)
+    log_startup(args)
+    with common.file_lock(config.lock_path):
+        worker.update()
+
+def cmd_rebuild(args):
+    """ renders the complete site """
+    config = load_settings(args)
+    worker = build_workflow(config)
+    log_startup(args)
+    with common.file_lock(config.lock_path):
+        worker.rebuild()
+
+def cmd_publish_due(args):
+    """ publishes the scheduled blog posts that are due, cheap if none are
+    
+    a running render daemon is notified, otherwise the site is updated 
+    """
+    from . import schedule
+    config = load_settings(args)
+    log_startup(args)
+    try:
+        due = schedule.PendingQueue.from_file(config.pending_path).due()
+    except common.NeedsRebuildError:
+        # the update will issue a rebuild
+        due = True
+    if not due:
+        common.log.info("cli: no scheduled blog posts are due")
+        return
+    from . import daemon
+    if not daemon.notify(config, "update"):
+        worker = build_workflow(config)
+        with common.file_lock(config.lock_path):
+            worker.update()
+
+def cmd_plan(args):
+    """ prints what an update or rebuild would render, without rendering """
+    from . import plan
+    config = load_settings(args)
+    log_startup(args)
+    worker = build_workflow(config)
+    # the stored state must not be written while it is read
+    with common.file_lock(config.lock_path, shared=True):
+        render_plan = plan.make_plan(worker, args.head, args.base)
+    timings = worker.timings or plan.RenderTimings()
+    if args.json:
+        print render_plan.as_json(timings)
+    else:
+        print render_plan.as_text(timings).encode("utf-8")
+
+def cmd_preview(args):
+    """ renders a git ref to its own preview directory """
+    from . import preview
+    config = load_settings(args)
+    log_startup(args)
+    with common.file_lock(config.lock_path):
+        branch_preview = preview.Preview(config, args.ref)
+        if args.remove:
+            branch_preview.remove()
+            return
+        preview_config = branch_preview.prepare()
+        build_workflow(preview_config).update()
+    print branch_preview.deploy_dir
+
+def cmd_retag(args):
+    """ merges tags into a new tag, commits and renders the changes """
+    config = load_settings(args)
+    worker = build_workflow(config)
+    log_startup(args)
+    message = args.message or "merge tags %s into %s" %\
+              (", ".join(args.old_tags), args.new_tag)
+    with common.file_lock(config.lock_path):
+        worker.retag(args.old_tags, args.new_tag, message)
+
+def cmd_daemon(args):
+    """ runs the render daemon """
+    from . import daemon
+    config = load_settings(args)
+    worker = build_workflow(config)
+    log_startup(args)
+    daemon.RenderDaemon(config, worker).serve_forever()
+
+def cmd_notify(args):
+    """ notifies the render daemon, renders directly if none is running """
+    from . import daemon
+    config = load_settings(args)
+    log_startup(args)
+    if not daemon.notify(config, args.what):
+        common.log.warn("cli: no render daemon found, rendering directly")
+        worker = build_workflow(config)
+        with common.file_lock(config.lock_path):
+            getattr(worker, args.what)()
+
+def cmd_inbox(args):
+    """ processes the inbox and commits and pushes the changes """
+    from . import inbox
+    config = load_settings(args)
+    log_startup(args)
+    inbox.FolderInbox(config).process()
+    if not args.dont_commit:
+        subprocess.check_call(["git", "add", "-A"])
+        subprocess.check_call(["git", "commit", "-m", args.message])
+        subprocess.check_call(["git", "push", "origin", "master"])
+
+def cmd_apply(args):
+    """ applies delta bundles to a copy of the deploy directory """
+    from . import delta
+    log_startup(args)
+    for bundle_path in args.bundles:
+        delta.apply_bundle(bundle_path, args.target, args.source)
+
+def cmd_serve(args):
+    """ serves the deploy directory with a simple http server """
+    from . import deploy
+    config = load_settings(args)
+    log_startup(args)
+    deploy.serve(config.deploy_dir, args.port)
+
+def build_parser():
+    """ returns the argument parser for the gitwig command """
+    parser = argparse.ArgumentParser(prog="gitwig",
+                                     description="a static blog engine with "\
+                                                 "git backend")
+    parser.add_argument("-C", action="store", default=".", metavar="directory",
+                        help="the directory of the site", dest="directory")
+    parser.add_argument("-c", action="store", default="config.yaml",
+                        metavar="config", help="the settings file, relative "\
+                        "to the site directory", dest="config")
+    parser.add_argument("-v", action="count", default=0, dest="verbose",
+                        help="more log messages, use twice for debugging")
+    parser.add_argument("-t", action="store_true", default=False, 
+                        help="log the startup time", dest="timing")
+    commands = parser.add_subparsers(dest="command")
+    
+    update = commands.add_parser("update", help="render the commits since "\
+                                  "the last rendered one")
+    update.set_defaults(function=cmd_update)
+    
+    rebuild = commands.add_parser("rebuild", help="render the complete site")
+    rebuild.set_defaults(function=cmd_rebuild)
+    
+    publish_due = commands.add_parser("publish-due", help="publish the "\
+                                      "scheduled blog posts that are due")
+    publish_due.set_defaults(function=cmd_publish_due)
+    
+    plan = commands.add_parser("plan", help="show what would be rendered")
+    plan.add_argument("head", nargs="?", default="HEAD", 
+                      help="the commit to plan for")
+    plan.add_argument("-b", action="store", default=None, metavar="base",
+                      help="the commit to compare with, the last rendered "\
+                      "one by default", dest="base")
+    plan.add_argument("-j", action="store_true", default=False, 
+                      help="print the plan as json", dest="json")
+    plan.set_defaults(function=cmd_plan)
+    
+    preview = commands.add_parser("preview", help="render a git ref to a "\
+                                  "preview directory")
+    preview.add_argument("ref", help="the branch or commit to preview")
+    preview.add_argument("-r", action="store_true", default=False,
+                         help="remove the preview", dest="remove")
+    preview.set_defaults(function=cmd_preview)
+    
+    retag = commands.add_parser("retag", help="merge tags into a new tag")
+    retag.add_argument("old_tags", nargs="+", metavar="old_tag",
+                       help="the tags to replace")
+    retag.add_argument("new_tag", help="the tag to replace them with")
+    retag.add_argument("-m", action="store", default=None, metavar="message",
+                       help="the commit message", dest="message")
+    retag.set_defaults(function=cmd_retag)
+    
+    inbox = commands.add_parser("inbox", help="process the inbox folder")
+    inbox.add_argument("-d", action="store_true", default=False, 
+                       help="don't commit", dest="dont_commit")
+    inbox.add_argument("-m", action="store", default="a gitwig update",
+                       help="a commit message", metavar="message", 
+                       dest="message")
+    inbox.set_defaults(function=cmd_inbox)
+    
+    serve = commands.add_parser("serve", help="serve the deploy directory")
+    serve.add_argument("-p", action="store", default=8000, type=int,
+                       help="the port to listen on", metavar="port", 
+                       dest="port")
+    serve.set_defaults(function=cmd_serve)
+    
+    apply = commands.add_parser("apply", help="apply delta bundles to a "\
+                                "copy of the deploy directory")
+    apply.add_argument("target", help="the directory to apply the bundles to")
+    apply.add_argument("bundles", nargs="+", metavar="bundle",
+                       help="the bundle directories, applied in this order")
+    apply.add_argument("-s", action="store", default=None, metavar="source",
+                       help="the directory to copy the files of a 'list' "\
+                       "bundle from", dest="source")
+    apply.set_defaults(function=cmd_apply)
+    
+    daemon = commands.add_parser("daemon", help="run the render daemon")
+    daemon.set_defaults(function=cmd_daemon)
+    
+    notify = commands.add_parser("notify", help="notify the render daemon")
+    notify.add_argument("what", nargs="?", default="update", 
+                        choices=["update", "rebuild"], 
+                        help="what should be rendered")
+    notify.set_defaults(function=cmd_notify)
+    return parser
+
+def main(argv=None):
+    """ entry point of the gitwig command """
+    args = build_parser().parse_args(argv)
+    common.log.setLevel(max(10, 30 - 10 * args.verbose))
+    try:
+        args.function(args)
+    except (common.BrokenLinksError, common.InvalidDeltaError,
+            common.PreviewError), e:
+        # a non zero exit status will stop a deploy script
+        common.log.error("cli: %s" % e.message)
+        sys.exit(1)
@@ -1,17 +1,50 @@
 """ common functions used in the package """
 
 # global imports
+import contextlib
+import fcntl
+import hashlib
 import os
 import logging
+import re
+import resource
 
 # setup of logging
 logging.basicConfig(level=logging.WARNING)
 log = logging.getLogger('gitwig')
 
+# regular expressions for stripping markdown
+regex_html_tags = re.compile(r"<[^>]*>")
+regex_link_targets = re.compile(r"\]\s*(\([^)]*\)|\[[^\]]*\])")
+regex_link_definitions = re.compile(r"^ {0,3}\[[^\]]+\]:.*$", re.MULTILINE)
+
 class NeedsRebuildError(Exception):
     """ an update from git is not possible and a rebuild should be issued """
     pass
 
+class CacheDriftError(NeedsRebuildError):
+    """ the cache does not match the git repository and should be reconciled
+    
+    shard is the key of a cache shard that could not be loaded, or None
+    """
+    
+    def __init__(self, message, shard=None):
+        """ initialization """
+        super(CacheDriftError, self).__init__(message)
+        self.shard = shard
+
+class BrokenLinksError(Exception):
+    """ the rendered pages contain broken internal links """
+    pass
+
+class InvalidDeltaError(Exception):
+    """ a delta bundle is incomplete or a file does not match its checksum """
+    pass
+
+class PreviewError(Exception):
+    """ a preview of a git ref could not be prepared """
+    pass
+
 class InboxFileExistsError(Exception):
     """ an update from git is not possible and a rebuild should be issued """
     pass
@@ -35,7 +68,54 @@ def walk(root_dir, source_extensions):
             if is_source_file(filepath, source_extensions):
                 yield filepath
 
+def item_key(item):
+    """ returns a key for a content item that can be stored in a file """
+    return (type(item).__name__, item.id)
+
 def date_tuple(blog_post, key="created"):
     """ returns a (year, month, day) tuple from a blog post header """
     date = blog_post.headers[key]
     return (date.year, date.month, date.day)
+
+def strip_markdown(text):
+    """ removes markup, link targets and link definitions from markdown """
+    text = regex_link_definitions.sub(" ", text)
+    text = regex_link_targets.sub(" ", text)
+    return regex_html_tags.sub(" ", text)
+
+def git_blob_sha(data):
+    """ returns the sha git uses for a blob with the given content """
+    return hashlib.sha1("blob %d\0%s" % (len(data), data)).hexdigest()
+
+def peak_memory_usage():
+    """ returns the peak resident set size of the process in kilobytes """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def break_hard_link(path):
+    """ removes a file that is hard linked to other paths before it is 
+    written again, so the other paths keep the old content
+
+    the deploy directory and the cache of a preview are hard linked to the
+    ones of the main site, see gitwig.preview
+    """
+    try:
+        if os.stat(path).st_nlink > 1:
+            os.remove(path)
+    except OSError:
+        pass
+
+@contextlib.contextmanager
+def file_lock(path, shared=False):
+    """ context manager holding an exclusive lock on a file 
+    
+    used to make sure that only one process renders the site at a time. a
+    shared lock is used by processes only reading the stored state, they 
+    can run together but not during a render
+    """
+    file_handle = open(path, "a")
+    try:
+        fcntl.flock(file_handle, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(file_handle, fcntl.LOCK_UN)
+        file_handle.close()
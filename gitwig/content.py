@@ -21,6 +21,9 @@ HEADER_KEYS =  ["title", "tags", "created", "updated", "uuid"]
 
 # regular expression for extracting tags from a string
 regex_split_tags = re.compile("[, ]+")
+# regular expressions for splitting a body into blocks and counting words
+regex_split_blocks = re.compile(r"\n\s*\n")
+regex_words = re.compile(r"\w+", re.UNICODE)
 
 # functions to convert header fields from and to python objects
 def parse_date(date_str):
@@ -40,6 +43,15 @@ def format_tags(tag_list):
     """ returns a string with comma separated tags from a set of tags"""
     return ", ".join(tag_list)
 
+def split_content(content):
+    """ returns the raw headers and the body of a content string """
+    parts = content.split(HEADER_BODY_SEPERATOR, 1)
+    if not ":" in parts[0] or len(parts) == 1:
+        # possibly only a body is present
+        return "", content
+    # we found (possibly) a header and a body
+    return parts[0], parts[1]
+
 def format_header_source(key, value):
     """ pretty formatting of key an value used in headers of the content """
     pretty_key = key.capitalize() + ":"
@@ -61,6 +73,10 @@ class BaseContent(object):
     
     # flag that this is not a related content like and index
     is_index = False
+    
+    # optional cache to fetch the body from instead of storing it in the
+    # object, see gitwig.cache.BodyCache
+    body_cache = None
 
     def __init__(self, id=None, headers=None):
         """ initialization, accepts an id and a dict with headers """
@@ -98,6 +114,13 @@ class BaseContent(object):
         self.read(file_handle)
         file_handle.close()
     
+    def load_body(self, file_path):
+        """ reads only the body of a file, the headers are not changed """
+        common.log.debug("base content: loading body from '%s'" % file_path)
+        file_handle = codecs.open(file_path, "r", encoding="utf-8")
+        raw_headers, self.body = split_content(file_handle.read())
+        file_handle.close()
+    
     def read(self, file_handle):
         """ reads and parses the content from a file like object """
         common.log.debug("base content: reading '%s'" % self.id)
@@ -105,15 +128,7 @@ class BaseContent(object):
     
     def parse_content(self, content):
         """ parses a content string for headers and body """
-        # separate raw headers and the body
-        parts = content.split(HEADER_BODY_SEPERATOR, 1)
-        raw_headers = parts[0]
-        if not ":" in raw_headers or len(parts) == 1:
-            # possibly only a body is present
-            raw_headers, self.body = "", content
-        else:
-            # we found (possibly) a header and a body
-            self.body = parts[1]
+        raw_headers, self.body = split_content(content)
         # parse the raw headers
         for line in StringIO.StringIO(raw_headers):
             try:
@@ -146,9 +161,11 @@ class BaseContent(object):
             # make sure that every value is a string
             functions = self.special_header_dict.get(key, (None, unicode))
             to_python, from_python = functions
-            value = self.headers.get(key, "")
+            value = self.headers.get(key)
+            # missing or unparsable values are stored as empty values
+            value = "" if value is None else from_python(value)
             # add a line to the source header
-            src_headers += format_header_source(key, from_python(value))
+            src_headers += format_header_source(key, value)
         return src_headers + u"\n" + self.body
 
     def get_url_parts(self):
@@ -161,10 +178,14 @@ class BaseContent(object):
     def get_body(self):
         """ returns the body of the content item
         
-        uses lazy loading if only the headers are set 
+        uses lazy loading if only the headers are set, either through the body
+        cache or by storing the loaded body in the object. the headers are not
+        read again, they might be changed after parsing
         """
         if self.body is None:
-            self.load(self.id)
+            if self.body_cache is not None:
+                return self.body_cache.get_body(self)
+            self.load_body(self.id)
         return self.body
             
 
@@ -174,9 +195,45 @@ class BlogPost(BaseContent):
     # template file used to render the blog post
     template = "post.html"
     
-    def __init__(self, id=None, headers=None):
-        """ initialization """
+    def __init__(self, id=None, headers=None, meta=None):
+        """ initialization 
+        
+        meta is a dict with precomputed data like the excerpt, see update_meta
+        """
         super(BlogPost, self).__init__(id, headers)
+        self.meta = meta or {}
+        # related blog posts, set from the cache before rendering
+        self.related = []
+        # the previous (older) and next (newer) blog post, if set from cache
+        self.previous = None
+        self.next = None
+    
+    def update_meta(self, converter, excerpt_blocks, words_per_minute):
+        """ precomputes an excerpt, the word count and the reading time 
+        
+        the excerpt are the first blocks of the body converted to html. if no 
+        converter is given, no excerpt is computed.
+        """
+        body = self.get_body()
+        # the digest of the body is used for the fingerprints of indices
+        self.meta["digest"] = hashlib.md5(body.encode("utf-8")).hexdigest()
+        words = len(regex_words.findall(common.strip_markdown(body)))
+        self.meta["words"] = words
+        self.meta["reading_time"] = max(1, -(-words // words_per_minute))
+        if converter is not None:
+            blocks = regex_split_blocks.split(body.strip(), excerpt_blocks)
+            excerpt = "\n\n".join(blocks[:excerpt_blocks])
+            self.meta["excerpt"] = converter(excerpt)
+    
+    def set_related_from_cache(self, cache):
+        """ sets the related blog posts of this post from cache """
+        self.related = list(cache.get_related(self.id))
+    
+    def set_neighbors_from_cache(self, cache):
+        """ sets the previous and next blog post of this post from cache """
+        previous, next = cache.neighbors(self.id)
+        self.previous = cache.get(previous) if previous else None
+        self.next = cache.get(next) if next else None
     
     def get_url_parts(self):
         """ returns all parts of the url as a tuple 
@@ -231,6 +288,9 @@ class BaseIndex(object):
     
     # attribute for this index in the cache
     cache_attribute = None
+    
+    # flag that the complete body of the blog posts is displayed
+    shows_body = False
 
     def __init__(self, id=None, content=None):
         """ initialization """
@@ -259,10 +319,36 @@ class BaseIndex(object):
         """ checks if this index is found in the cache """
         return self.id in getattr(cache, self.cache_attribute)
     
+    def get_post_ids(self, cache):
+        """ returns the ids of the blog posts displayed by this index """
+        blog_ids = getattr(cache, self.cache_attribute)[self.id]
+        return cache.sort_ids(blog_ids)
+    
+    def get_posts(self, cache):
+        """ returns the blog posts displayed by this index from cache """
+        blog_ids = getattr(cache, self.cache_attribute)[self.id]
+        return cache.posts_by_id_list(blog_ids)
+    
     def set_content_from_cache(self, cache):
         """ sets the content of this index from cache """
-        blog_ids = getattr(cache, self.cache_attribute)[self.id]
-        self.content = cache.posts_by_id_list(blog_ids)
+        self.content = self.get_posts(cache)
+    
+    def fingerprint(self, cache, with_body=None):
+        """ returns a digest of the data displayed by this index 
+        
+        the data are the ids, order, titles, dates, tags, excerpts, word 
+        counts and reading times of the blog posts and the digest of their 
+        bodies if they are displayed. the fingerprints of the blog posts are 
+        taken from the cache, so no blog post needs to be loaded.
+        
+        with_body:
+            includes the bodies, defaults to shows_body
+        """
+        if with_body is None:
+            with_body = self.shows_body
+        data = [cache.post_fingerprint(id, with_body) 
+                for id in self.get_post_ids(cache)]
+        return hashlib.md5(repr(data)).hexdigest()
     
     @classmethod
     def from_cache(cls, id=None, cache=None):
@@ -373,6 +459,10 @@ class TagIndex(BaseIndex):
     def set_content_from_cache(self, cache):
         """ sets the content of the all tag index from cache """
         self.content = cache.get_tag_count()
+    
+    def fingerprint(self, cache, with_body=None):
+        """ returns a digest of the tags and their counts """
+        return hashlib.md5(repr(cache.get_tag_count())).hexdigest()
         
 
 class BlogIndex(BaseIndex):
@@ -385,6 +475,7 @@ class BlogIndex(BaseIndex):
         """ initialization, see also TagIndex """
         content = content or []
         super(BlogIndex, self).__init__("*blog index?", content)
+        self.number_of_posts = 25
 
     def get_url_parts(self):
         """ returns all parts of the relative url as a tuple """
@@ -398,9 +489,19 @@ class BlogIndex(BaseIndex):
         """
         return True
         
-    def set_content_from_cache(self, cache, number_of_posts):
+    def get_post_ids(self, cache):
+        """ returns the ids of the latest blog posts """
+        return cache.sorted_ids[:self.number_of_posts]
+    
+    def get_posts(self, cache):
+        """ returns the latest blog posts from cache """
+        return cache.get_latest(self.number_of_posts)
+        
+    def set_content_from_cache(self, cache, number_of_posts=None):
         """ sets the content of the blog index from cache """
-        self.content = cache.get_latest(number_of_posts)
+        if number_of_posts is not None:
+            self.number_of_posts = number_of_posts
+        self.content = self.get_posts(cache)
     
     @classmethod
     def from_cache(cls, id=None, cache=None, number_of_posts=25):
@@ -416,10 +517,17 @@ class FeedIndex(BaseIndex):
     # template file used to render the blog post
     template = "feed.xml"
     
+    # the feed contains the complete blog posts
+    shows_body = True
+    
+    # the tag of a single tag feed, see TagFeed
+    tag = None
+    
     def __init__(self, id=None, content=None):
         """ initialization, see also TagIndex """
         content = content or []
         super(FeedIndex, self).__init__("*feed index?", content)
+        self.number_of_posts = 25
 
     def get_url_parts(self):
         """ returns all parts of the relative url as a tuple """
@@ -433,9 +541,19 @@ class FeedIndex(BaseIndex):
         """
         return True
             
-    def set_content_from_cache(self, cache, number_of_posts):
+    def get_post_ids(self, cache):
+        """ returns the ids of the latest blog posts """
+        return cache.sorted_ids[:self.number_of_posts]
+    
+    def get_posts(self, cache):
+        """ returns the latest blog posts from cache """
+        return cache.get_latest(self.number_of_posts)
+        
+    def set_content_from_cache(self, cache, number_of_posts=None):
         """ sets the content of the blog index from cache """
-        self.content = cache.get_latest(number_of_posts)
+        if number_of_posts is not None:
+            self.number_of_posts = number_of_posts
+        self.content = self.get_posts(cache)
 
     @classmethod
     def from_cache(cls, id=None, cache=None, number_of_posts=25):
@@ -443,3 +561,111 @@ class FeedIndex(BaseIndex):
         instance = cls(id)
         instance.set_content_from_cache(cache, number_of_posts)
         return instance
+
+
+class TagFeed(FeedIndex):
+    """ content class for the feed of a single tag, uses the feed template 
+    
+    the template can use content.tag, which is None for the blog feed
+    """
+    
+    # attribute for this index in the cache
+    cache_attribute = "tags"
+    
+    def __init__(self, id=None, content=None):
+        """ initialization """
+        BaseIndex.__init__(self, id, content or [])
+        self.number_of_posts = 25
+    
+    @property
+    def tag(self):
+        """ the tag of the feed """
+        return self.id
+    
+    def get_url_parts(self):
+        """ returns all parts of the relative url as a tuple """
+        return ("tags", self.id + ".xml")
+    
+    def is_in_cache(self, cache):
+        """ checks if the tag is found in the cache """
+        return BaseIndex.is_in_cache(self, cache)
+    
+    def get_post_ids(self, cache):
+        """ returns the ids of the latest blog posts with the tag """
+        return cache.latest_ids(cache.tags[self.id], self.number_of_posts)
+    
+    def get_posts(self, cache):
+        """ returns the latest blog posts with the tag from cache """
+        return (cache.get(id) for id in self.get_post_ids(cache))
+
+
+class TagCloud(BaseIndex):
+    """ content class for the tag cloud fragment shared by all pages 
+    
+    fragments are rendered without a doctype, to be included by server side
+    includes or on the client side
+    """
+
+    # template file used to render the fragment
+    template = "fragments/tags.html"
+    
+    def __init__(self, id=None, content=None):
+        """ initialization, see also TagIndex """
+        content = content or []
+        super(TagCloud, self).__init__("*tag cloud?", content)
+    
+    def get_url_parts(self):
+        """ returns all parts of the relative url as a tuple """
+        return ("fragments", "tags.html")
+    
+    def __iter__(self):
+        """ implementation of the iter protocol a generator """
+        for id, count in self.content:
+            yield (TagPage(id), count)
+
+    def is_in_cache(self, cache):
+        """ the fragment is always rendered, see TagIndex """
+        return True
+    
+    def set_content_from_cache(self, cache):
+        """ sets the tags and their counts from cache """
+        self.content = cache.get_tag_count()
+    
+    def fingerprint(self, cache, with_body=None):
+        """ returns a digest of the tags and their counts """
+        return hashlib.md5(repr(cache.get_tag_count())).hexdigest()
+
+
+class MonthArchive(BaseIndex):
+    """ content class for the month archive fragment shared by all pages,
+    see TagCloud
+    """
+
+    # template file used to render the fragment
+    template = "fragments/archive.html"
+    
+    def __init__(self, id=None, content=None):
+        """ initialization, see also TagIndex """
+        content = content or []
+        super(MonthArchive, self).__init__("*month archive?", content)
+    
+    def get_url_parts(self):
+        """ returns all parts of the relative url as a tuple """
+        return ("fragments", "archive.html")
+    
+    def __iter__(self):
+        """ implementation of the iter protocol a generator """
+        for id, count in self.content:
+            yield (MonthIndex(id), count)
+
+    def is_in_cache(self, cache):
+        """ the fragment is always rendered, see TagIndex """
+        return True
+    
+    def set_content_from_cache(self, cache):
+        """ sets the months and their counts from cache, the newest first """
+        self.content = cache.get_month_count()
+    
+    def fingerprint(self, cache, with_body=None):
+        """ returns a digest of the months and their counts """
+        return hashlib.md5(repr(cache.get_month_count())).hexdigest()
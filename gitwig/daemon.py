@@ -0,0 +1,133 @@
+""" a long running render daemon and the client to notify it
+
+the daemon keeps the settings, templates, converters and the blog cache in 
+memory. git hooks notify the daemon over a unix socket in the site directory.
+notifications that arrive while the site is rendered are coalesced into one 
+update: the update always renders all commits up to the newest head.
+"""
+
+# global imports
+import os
+import signal
+import socket
+import SocketServer
+import threading
+
+# local imports
+from . import common
+
+# commands understood by the daemon
+COMMANDS = ("update", "rebuild")
+
+
+class RenderDaemon(object):
+    """ renders the site when notified, one render at a time """
+
+    def __init__(self, config, workflow):
+        """ initialization 
+        
+        workflow:
+            a gitwig.deploy.Workflow instance, that will keep its cache in
+            memory between the runs
+        """
+        self.config = config
+        self.workflow = workflow
+        self.workflow.keep_cache = True
+        # set if a render is requested, queued requests are coalesced
+        self.pending = threading.Event()
+        self.rebuild_requested = False
+        self.server = None
+
+    def notify(self, command):
+        """ queues a command, called for every notification """
+        common.log.info("daemon: received '%s'" % command)
+        if command == "rebuild":
+            self.rebuild_requested = True
+        self.pending.set()
+
+    def serve_forever(self):
+        """ listens for notifications and renders the site until interrupted """
+        socket_path = self.config.daemon_socket
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.server = NotificationServer(socket_path, self)
+        listener = threading.Thread(target=self.server.serve_forever)
+        listener.daemon = True
+        listener.start()
+        common.log.warn("daemon: listening on '%s'" % socket_path)
+        signal.signal(signal.SIGTERM, self._terminate)
+        try:
+            # an initial update brings the site to the current head
+            self.pending.set()
+            while True:
+                # a timeout keeps the main thread responsive to signals
+                self.pending.wait(1)
+                if self.pending.is_set():
+                    self.run_once()
+        except (KeyboardInterrupt, SystemExit):
+            common.log.warn("daemon: shutting down")
+        finally:
+            self.server.shutdown()
+            self.server.server_close()
+            os.remove(socket_path)
+
+    def _terminate(self, signum, frame):
+        """ signal handler, leaves the main loop and cleans up """
+        raise SystemExit(0)
+
+    def run_once(self):
+        """ runs one render for all queued notifications """
+        self.pending.clear()
+        rebuild, self.rebuild_requested = self.rebuild_requested, False
+        try:
+            with common.file_lock(self.config.lock_path):
+                if rebuild:
+                    self.workflow.rebuild()
+                else:
+                    self.workflow.update()
+        except common.BrokenLinksError, e:
+            # the rendered site and the cache are consistent
+            common.log.error("daemon: %s" % e.message)
+        except Exception:
+            # the daemon should survive a failed render, the cache is read 
+            # from file on the next run
+            common.log.exception("daemon: rendering failed")
+            self.workflow.cache = None
+
+
+class NotificationHandler(SocketServer.StreamRequestHandler):
+    """ reads one command per connection and queues it """
+
+    def handle(self):
+        """ handles a notification """
+        command = self.rfile.readline().strip()
+        if command in COMMANDS:
+            self.server.daemon.notify(command)
+            self.wfile.write("queued\n")
+        else:
+            self.wfile.write("unknown command\n")
+
+
+class NotificationServer(SocketServer.UnixStreamServer):
+    """ unix socket server that passes notifications to the daemon """
+
+    def __init__(self, socket_path, daemon):
+        """ initialization """
+        self.daemon = daemon
+        SocketServer.UnixStreamServer.__init__(self, socket_path, 
+                                               NotificationHandler)
+
+
+def notify(config, command="update"):
+    """ notifies a running daemon, returns False if none is listening """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(config.daemon_socket)
+        client.sendall(command + "\n")
+        answer = client.makefile().readline().strip()
+        common.log.info("daemon: '%s' %s" % (command, answer))
+        return True
+    except socket.error:
+        return False
+    finally:
+        client.close()
@@ -0,0 +1,236 @@
+""" delta bundles for replicating the deploy directory to other web servers
+
+every run writes a bundle directory to the delta directory with a
+manifest.json file:
+
+ -  commit: the rendered git commit
+ -  rebuild: true if the bundle was written by a rebuild
+ -  written: a mapping of the written paths to the sha1 of their content
+ -  deleted: a list of the deleted paths
+
+the paths are relative to the deploy directory. depending on the setting the
+changed files are added as a files.tar.gz archive ("tar") or as a files
+directory ("dir"), or only the manifest is written ("list"). the bundles are
+named by their creation time, so they can be applied in the order of their
+names with apply_bundle.
+"""
+
+# global imports
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+
+# local imports
+from . import common
+
+MANIFEST_FILE_NAME = "manifest.json"
+ARCHIVE_FILE_NAME = "files.tar.gz"
+FILES_DIR_NAME = "files"
+BUNDLE_TYPES = ("list", "tar", "dir")
+
+
+def file_sha(path):
+    """ returns the sha1 of the content of a file """
+    sha = hashlib.sha1()
+    file_handle = open(path, "rb")
+    for chunk in iter(lambda: file_handle.read(64 * 1024), ""):
+        sha.update(chunk)
+    file_handle.close()
+    return sha.hexdigest()
+
+
+class DeltaBundle(object):
+    """ collects the changed paths of the deploy directory and writes them """
+
+    def __init__(self, config):
+        """ initialization """
+        self.config = config
+        self.deploy_dir = os.path.abspath(config.deploy_dir)
+        # changed paths relative to the deploy directory, collected until the
+        # next bundle is written, also over failed runs
+        self.written = set()
+        self.deleted = set()
+
+    def _relative(self, path):
+        """ returns a path relative to the deploy directory """
+        return os.path.relpath(os.path.abspath(path), self.deploy_dir)
+
+    def add_written(self, path):
+        """ records a written file """
+        path = self._relative(path)
+        self.deleted.discard(path)
+        self.written.add(path)
+
+    def add_deleted(self, path):
+        """ records a deleted file """
+        path = self._relative(path)
+        self.written.discard(path)
+        self.deleted.add(path)
+
+    def hold(self):
+        """ keeps the recorded changes for the next bundle instead of writing
+        one, e.g. if the rendered pages have broken links
+        """
+        self._merge_held()
+        held_path = self.config.delta_held_path
+        file_handle = open(held_path, "wb")
+        json.dump({"written": sorted(self.written),
+                   "deleted": sorted(self.deleted)}, file_handle, indent=1)
+        file_handle.close()
+        common.log.info("delta: holding back %d written and %d deleted files "\
+                        "in '%s'" % (len(self.written), len(self.deleted),
+                                     held_path))
+        self.written, self.deleted = set(), set()
+
+    def _merge_held(self):
+        """ adds the changes held back by former runs, the recorded changes
+        are newer
+        """
+        held_path = self.config.delta_held_path
+        if not os.path.isfile(held_path):
+            return
+        try:
+            file_handle = open(held_path, "rb")
+            held = json.load(file_handle)
+            file_handle.close()
+        except (IOError, ValueError):
+            common.log.warn("delta: could not read '%s'" % held_path)
+            return
+        written, deleted = self.written, self.deleted
+        self.written, self.deleted = set(held["written"]), set(held["deleted"])
+        self.deleted.difference_update(written)
+        self.written.difference_update(deleted)
+        self.written.update(written)
+        self.deleted.update(deleted)
+
+    def write(self, commit, rebuild=False):
+        """ writes a bundle with the recorded changes and returns its path 
+        
+        changes held back by former runs are added
+        """
+        self._merge_held()
+        bundle_type = self.config.delta_bundle
+        if bundle_type not in BUNDLE_TYPES:
+            common.log.warn("delta: unknown bundle type '%s'" % bundle_type)
+            bundle_type = "list"
+        name = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S.%f")
+        bundle_path = os.path.join(self.config.delta_dir, name)
+        os.makedirs(bundle_path)
+        written = dict()
+        for path in sorted(self.written):
+            full_path = os.path.join(self.deploy_dir, path)
+            if os.path.isfile(full_path):
+                written[path] = file_sha(full_path)
+        if bundle_type == "tar":
+            archive = tarfile.open(os.path.join(bundle_path,
+                                                ARCHIVE_FILE_NAME), "w:gz")
+            for path in sorted(written):
+                archive.add(os.path.join(self.deploy_dir, path), path)
+            archive.close()
+        elif bundle_type == "dir":
+            for path in written:
+                dest_path = os.path.join(bundle_path, FILES_DIR_NAME, path)
+                if not os.path.isdir(os.path.dirname(dest_path)):
+                    os.makedirs(os.path.dirname(dest_path))
+                shutil.copy2(os.path.join(self.deploy_dir, path), dest_path)
+        manifest = {
+            "commit": commit,
+            "rebuild": rebuild,
+            "type": bundle_type,
+            "written": written,
+            "deleted": sorted(self.deleted) }
+        # the manifest is written last, a bundle without one is incomplete
+        file_handle = open(os.path.join(bundle_path, MANIFEST_FILE_NAME), "wb")
+        json.dump(manifest, file_handle, indent=1, sort_keys=True)
+        file_handle.close()
+        common.log.info("delta: wrote '%s' with %d written and %d deleted "\
+                        "files" % (bundle_path, len(written),
+                                   len(self.deleted)))
+        self.written, self.deleted = set(), set()
+        if os.path.isfile(self.config.delta_held_path):
+            os.remove(self.config.delta_held_path)
+        self._remove_old_bundles()
+        return bundle_path
+
+    def _remove_old_bundles(self):
+        """ removes all but the last delta_keep bundles """
+        if not self.config.delta_keep:
+            return
+        names = sorted(os.listdir(self.config.delta_dir))
+        for name in names[:-self.config.delta_keep]:
+            common.log.debug("delta: removing old bundle '%s'" % name)
+            shutil.rmtree(os.path.join(self.config.delta_dir, name))
+
+
+def apply_bundle(bundle_path, target_dir, source_dir=None):
+    """ applies a delta bundle to a copy of the deploy directory
+
+    the files of a "list" bundle are copied from the source directory. the
+    sha1 of every file is checked before it replaces the old one, a
+    gitwig.common.InvalidDeltaError is raised if a check fails.
+    """
+    try:
+        file_handle = open(os.path.join(bundle_path, MANIFEST_FILE_NAME), "rb")
+        manifest = json.load(file_handle)
+        file_handle.close()
+    except (IOError, ValueError):
+        raise common.InvalidDeltaError("no manifest found in '%s'" %\
+                                       bundle_path)
+    bundle_type = manifest["type"]
+    if bundle_type == "list" and source_dir is None:
+        raise common.InvalidDeltaError("'%s' has no files, a source "\
+                                       "directory is needed" % bundle_path)
+    archive = None
+    if bundle_type == "tar":
+        archive = tarfile.open(os.path.join(bundle_path, ARCHIVE_FILE_NAME))
+    for path, sha in sorted(manifest["written"].iteritems()):
+        _check_relative(path)
+        dest_path = os.path.join(target_dir, path)
+        tmp_path = dest_path + ".delta-tmp"
+        if not os.path.isdir(os.path.dirname(dest_path)):
+            os.makedirs(os.path.dirname(dest_path))
+        if archive is not None:
+            src_handle = archive.extractfile(path)
+        elif bundle_type == "dir":
+            src_handle = open(os.path.join(bundle_path, FILES_DIR_NAME, path),
+                              "rb")
+        else:
+            src_handle = open(os.path.join(source_dir, path), "rb")
+        dest_handle = open(tmp_path, "wb")
+        shutil.copyfileobj(src_handle, dest_handle)
+        dest_handle.close()
+        src_handle.close()
+        if file_sha(tmp_path) != sha:
+            os.remove(tmp_path)
+            raise common.InvalidDeltaError("wrong checksum for '%s'" % path)
+        # the old file is replaced atomically
+        os.rename(tmp_path, dest_path)
+    if archive is not None:
+        archive.close()
+    for path in manifest["deleted"]:
+        _check_relative(path)
+        dest_path = os.path.join(target_dir, path)
+        if os.path.isfile(dest_path):
+            os.remove(dest_path)
+        _remove_empty_parents(os.path.dirname(dest_path), target_dir)
+    common.log.info("delta: applied '%s' with %d written and %d deleted "\
+                    "files" % (bundle_path, len(manifest["written"]),
+                               len(manifest["deleted"])))
+
+def _check_relative(path):
+    """ makes sure a path from a manifest stays in the target directory """
+    path = os.path.normpath(path)
+    if os.path.isabs(path) or path.split(os.path.sep)[0] == os.path.pardir:
+        raise common.InvalidDeltaError("invalid path '%s'" % path)
+
+def _remove_empty_parents(dir_path, target_dir):
+    """ removes empty directories up to the target directory """
+    target_dir = os.path.abspath(target_dir)
+    dir_path = os.path.abspath(dir_path)
+    while dir_path != target_dir and dir_path.startswith(target_dir) and \
+          os.path.isdir(dir_path) and not os.listdir(dir_path):
+        os.rmdir(dir_path)
+        dir_path = os.path.dirname(dir_path)
@@ -1,17 +1,25 @@
 """ rendering and deployment of items defined by a renderset """
 
 # global imports
-from genshi.template import TemplateLoader
-from genshi.filters.transform import Transformer
-import git
-import markdown
+# genshi and git are imported where needed, to keep the import of this module
+# cheap for commands that don't render anything
+import collections
+import hashlib
 import os
+import re
 import socket
+import subprocess
+import time
 
 # local imports
 from . import cache
 from . import common
 from . import renderset
+from . import search
+
+# regular expression for links in converted content, which is not part of the
+# genshi stream as separate elements
+regex_markup_links = re.compile(r"""\b(?:href|src)\s*=\s*["']([^"']*)["']""")
 
 
 class Renderer(object):
@@ -21,7 +29,8 @@ class Renderer(object):
     and then rendered using a template
     """
 
-    def __init__(self, settings, template_function, converter_function):
+    def __init__(self, settings, template_function, converter_function,
+                 link_graph=None, page_tree=None):
         """ initialization
         
         converter_function:
@@ -32,14 +41,23 @@ class Renderer(object):
         template_function:
             callable to render a content object using a template
             the callable should accept a template path and a data dict
+        link_graph:
+            optional gitwig.links.LinkGraph, told which page is rendered so
+            the template function can record its links
+        page_tree:
+            optional gitwig.pagetree.PageTree, available as "pages" in the
+            templates, it records the sections looked up by a page
         """
         
         self.deploy_dir = settings.deploy_dir
         self.templating = template_function
+        self.link_graph = link_graph
+        self.page_tree = page_tree
         # standard set of data that is used in a template
         self.common_data = {
             "settings": settings,
-            "converter": converter_function
+            "converter": converter_function,
+            "pages": page_tree
         }
             
     def __call__(self, content_object):
@@ -55,7 +73,12 @@ class Renderer(object):
         sub_path_parts = content_object.get_url_parts()
         deploy_path = self._check_deploy_dir(self.deploy_dir, *sub_path_parts)
         common.log.info("render: deploying '%s'" % deploy_path)
+        if self.link_graph is not None:
+            self.link_graph.begin_page("/" + "/".join(sub_path_parts))
+        if self.page_tree is not None:
+            self.page_tree.begin_page(content_object)
         # render to file using the templating function
+        common.break_hard_link(deploy_path)
         deploy_handle = open(deploy_path, "w")
         deploy_handle.write(self.templating(content_object.template, data))
         deploy_handle.close()
@@ -72,34 +95,102 @@ class Renderer(object):
 class MarkdownConverter(object):
     """ callable to convert a content object by using a markdown instance """
 
-    def __init__(self, markdown_instance):
-        """ initialization """
+    def __init__(self, markdown_instance, highlight_cache=None, 
+                 highlight_cache_path=None, memo_size=0):
+        """ initialization 
+        
+        highlight_cache:
+            optional gitwig.highlight.HighlightCache for memoizing code 
+            highlighting, it is written to the highlight_cache_path by 
+            write_cache
+        memo_size:
+            number of characters of converted content kept in memory, a blog
+            post shown in several feeds is only converted once. 0 disables
+            the memo
+        """
         self.markdown_instance =  markdown_instance
+        self.highlight_cache = highlight_cache
+        self.highlight_cache_path = highlight_cache_path
+        if highlight_cache is not None:
+            highlight_cache.install(markdown_instance)
+        # least recently used conversions, by the digest of the content
+        self.memo_size = memo_size
+        self.memo = collections.OrderedDict()
+        self.memo_chars = 0
 
     def __call__(self, content_to_convert):
         """ resets the markdown instance and returns the converted content """
+        if not self.memo_size:
+            return self._convert(content_to_convert)
+        key = hashlib.md5(content_to_convert.encode("utf-8")).digest()
+        converted = self.memo.pop(key, None)
+        if converted is None:
+            converted = self._convert(content_to_convert)
+        else:
+            self.memo_chars -= len(converted)
+        # the most recently used conversion is stored at the end
+        self.memo[key] = converted
+        self.memo_chars += len(converted)
+        while self.memo_chars > self.memo_size and len(self.memo) > 1:
+            old_key, old_converted = self.memo.popitem(last=False)
+            self.memo_chars -= len(old_converted)
+        return converted
+    
+    def _convert(self, content_to_convert):
+        """ converts content with the reset markdown instance """
         self.markdown_instance.reset()
         return self.markdown_instance.convert(content_to_convert)
+    
+    def write_cache(self):
+        """ persists the highlight cache, if one is used """
+        if self.highlight_cache is not None:
+            self.highlight_cache.write(self.highlight_cache_path)
 
 
 class GenshiTemplating(object):
     """ callable to use genshi as a templating function """
 
-    def __init__(self, config):
-        """ initialization """
+    def __init__(self, config, link_graph=None, media=None):
+        """ initialization 
+        
+        link_graph:
+            optional gitwig.links.LinkGraph that records the links found in
+            the rendered streams
+        media:
+            optional gitwig.media.MediaFingerprints, used for versioned urls
+            of the files in the static media directory
+        """
+        from genshi.template import TemplateLoader
         self.config = config
-        self.template_loader = TemplateLoader(config.template_dir)
+        self.link_graph = link_graph
+        self.media = media
+        # changed templates are reloaded, needed for a long running process
+        self.template_loader = TemplateLoader(config.template_dir, 
+                                              auto_reload=True)
 
     def __call__(self, template, data):
         """ returns the rendered genshi stream """
         render_type, doctype = self._types_by_template(template)
+        if self.media is not None and "content" in data:
+            self.media.begin_page(data["content"])
         template = self.template_loader.load(template)
         stream = self._transform_stream(template.generate(**data))
-        return stream.render(render_type, doctype=doctype)
+        if not self.config.minify:
+            return stream.render(render_type, doctype=doctype)
+        from . import minify
+        minify_filter = minify.MinifyFilter(render_type)
+        output = (stream | minify_filter).render(render_type, doctype=doctype)
+        common.log.debug("render: minified to %d chars, %d removed" %\
+                         (len(output), minify_filter.removed))
+        return output
 
     def _types_by_template(self, template):
-        """ how a template should be rendered """
-        return ("xml", None) if template.endswith(".xml") else ("html", "html5")
+        """ how a template should be rendered, fragments have no doctype """
+        if template.endswith(".xml"):
+            return ("xml", None)
+        if template.startswith("fragments/"):
+            return ("html", None)
+        return ("html", "html5")
 
     def _transform_stream(self, stream):
         """ transformations of the genshi stream
@@ -107,10 +198,30 @@ class GenshiTemplating(object):
         the basic transformation is to point directory local references to 
         the static media directory
         """
+        from genshi.filters.transform import Transformer
         stream |= Transformer('//*[@href]').attr('href', self._dll2smd)
         stream |= Transformer('//*[@src]').attr('src', self._dll2smd)
+        if self.link_graph is not None:
+            stream |= self._collect_links
         return stream
 
+    def _collect_links(self, stream):
+        """ stream filter passing the links to the link graph
+        
+        links in converted content are found in markup text events
+        """
+        from genshi.core import START, TEXT, Markup
+        for kind, data, pos in stream:
+            if kind is START:
+                for name in ("href", "src"):
+                    href = data[1].get(name)
+                    if href:
+                        self.link_graph.add_link(href)
+            elif kind is TEXT and isinstance(data, Markup):
+                for href in regex_markup_links.findall(data):
+                    self.link_graph.add_link(href)
+            yield kind, data, pos
+
     def _dll2smd(self, name, event):
         """ points directory local references to the static media directory 
         
@@ -119,6 +230,8 @@ class GenshiTemplating(object):
         attrs = event[1][1]
         href = attrs.get(name)
         if href and not href.startswith("#") and "/" not in href:
+            if self.media is not None:
+                return self.media.url(href)
             href = self.config.media_prefix + "/" + href
         return href
 
@@ -130,51 +243,370 @@ class Workflow(object):
     """
 
 
-    def __init__(self, config, render_function):
+    def __init__(self, config, render_function, converter_function=None,
+                 link_graph=None, media=None, delta=None, timings=None,
+                 page_tree=None):
         """ initialization 
         
         render_function:
             callable that accepts a conten item and renders it to a file
             see Renderer
+        converter_function:
+            optional callable used to precompute the html excerpts of blog
+            posts, see MarkdownConverter
+        link_graph:
+            optional gitwig.links.LinkGraph, the links of the rendered pages
+            are checked after each run
+        media:
+            optional gitwig.media.MediaFingerprints, pages referencing a 
+            changed media file are rendered on an update
+        delta:
+            optional gitwig.delta.DeltaBundle, a bundle of the changed files
+            is written after each run
+        timings:
+            optional gitwig.plan.RenderTimings, the render times of the item
+            types are recorded for estimating the time of a run
+        page_tree:
+            optional gitwig.pagetree.PageTree, pages looking up a changed
+            section of the static pages are rendered on an update
         """
         self.config = config
         self.render = render_function
+        self.converter = converter_function
+        self.link_graph = link_graph
+        self.media = media
+        self.delta = delta
+        self.timings = timings
+        self.page_tree = page_tree
+        # a long running process may keep the cache in memory between runs,
+        # see gitwig.daemon
+        self.keep_cache = False
+        self.cache = None
+        # items that failed to render in the current run, (id, message)
+        self.errors = []
 
     def rebuild(self):
-        """ workflow for rebuilding a complete site """
-        tmp_cache = cache.BlogCache()
-        what = renderset.Rebuild(self.config, tmp_cache)
+        """ workflow for rebuilding a complete site 
+        
+        if checkpoints are enabled, an interrupted rebuild of the same commit 
+        resumes from its last checkpoint, see gitwig.checkpoint
+        """
+        search_index = self._search_index(rebuild=True)
+        if self.link_graph is not None:
+            self.link_graph.begin_run(rebuild=True)
+        if self.media is not None:
+            self.media.begin_run(rebuild=True)
+        if self.page_tree is not None:
+            self.page_tree.begin_run(rebuild=True)
+        self.errors = []
+        checkpoint, done = None, set()
+        if self.config.checkpoint_interval:
+            from . import checkpoint
+            checkpoint = checkpoint.Checkpoint(self.config)
+            tmp_cache, done = checkpoint.resume(self._head_commit(),
+                                                self.link_graph, self.media,
+                                                self.page_tree)
+        else:
+            tmp_cache = cache.BlogCache()
+            tmp_cache.commit = self._head_commit()
+        what = renderset.Rebuild(self.config, tmp_cache, self.converter)
+        what.pending = self._pending_queue(rebuild=True)
+        what.page_tree = self.page_tree
+        if checkpoint is not None:
+            what.checkpoint = lambda: checkpoint.write(tmp_cache, done, 
+                                                       self.link_graph, 
+                                                       self.media,
+                                                       self.page_tree)
+        rendered = 0
         for item in what.items_to_render():
-            self.render(item)
-        tmp_cache.write(self.config.cache_path)
+            key = common.item_key(item)
+            if key in done:
+                self._restore_item(item)
+                what.rendered(item)
+            elif self._render_item(item):
+                what.rendered(item)
+                done.add(key)
+                rendered += 1
+                if checkpoint is not None and \
+                   rendered % self.config.checkpoint_interval == 0:
+                    what.checkpoint()
+            if search_index:
+                search_index.add(item)
+        if checkpoint is not None:
+            checkpoint.finish(tmp_cache)
+        else:
+            tmp_cache.write(self.config.cache_dir)
+        if search_index:
+            search_index.write(self.config.search_cache_path)
+        self._write_converter_cache()
+        self._write_media()
+        self._write_page_tree()
+        self._write_pending(what.pending)
+        self._write_timings()
         self._clean_empty_directories()
+        self._log_peak_memory_usage()
+        if self.keep_cache:
+            self.cache = tmp_cache
+        self._write_error_report(what.errors)
+        self._finish_run(tmp_cache.commit, rebuild=True)
         
     def update(self):
-        """ workflow for updating a site according to the last git commit """
+        """ workflow for updating a site according to the git commits 
+        
+        all commits since the one stored in the cache are rendered. if the 
+        cache does not know its commit, only the last commit is rendered.
+        
+        if the blog posts in the cache don't match the git repository, the
+        update is repeated with a reconciliation of the cache. shards of the
+        cache that could not be loaded are dropped and their blog posts are
+        read again. if this does not help, the site is rebuilt.
+        """
+        reconcile, broken_shards = False, set()
+        while True:
+            try:
+                if not self._update(reconcile, broken_shards):
+                    return
+                break
+            except common.CacheDriftError, e:
+                if reconcile and (e.shard is None or e.shard in broken_shards):
+                    common.log.warn(" %s, issuing rebuild" % e.message)
+                    self.rebuild()
+                    return
+                common.log.warn(" %s, reconciling the cache" % e.message)
+                reconcile = True
+                if e.shard is not None:
+                    broken_shards.add(e.shard)
+            except common.NeedsRebuildError, e:
+                # if a cache error occurs or a template has changed, we need to 
+                # rebuild the site
+                common.log.warn(" %s, issuing rebuild" % e.message)
+                self.rebuild()
+                return
+    
+    def _update(self, reconcile=False, broken_shards=()):
+        """ renders the changes since the last rendered commit 
+        
+        if reconcile is set, the blog posts are taken from the differences
+        of the cache and the head commit, see renderset.Update.reconcile. 
+        returns False if there was nothing to update
+        """
+        import git
+        repo = git.Repo(".")
+        head_commit = repo.head.commit
+        # load cache, the cache in memory might be changed by a failed run
+        tmp_cache = self._load_cache()
+        for shard in broken_shards:
+            tmp_cache.drop_shard(shard)
+        base_commit, what = self.prepare_update(repo, tmp_cache, head_commit,
+                                                reconcile=reconcile)
+        if what is None:
+            if self.keep_cache:
+                self.cache = tmp_cache
+            return False
+        tmp_cache.commit = head_commit.hexsha
+        search_index = self._search_index(rebuild=False)
+        if self.link_graph is not None:
+            self.link_graph.begin_run(rebuild=False)
+        self.errors = []
+        self._apply(what, tmp_cache, search_index)
+        return True
+    
+    def prepare_update(self, repo, tmp_cache, head_commit, base=None,
+                       reconcile=False):
+        """ returns the base commit and the update renderset with the changes 
+        up to the head commit, used by update and gitwig.plan
+        
+        the base defaults to the last rendered commit. the renderset is None 
+        if there is nothing to update. the page tree and the media 
+        fingerprints are loaded, but not written. raises a NeedsRebuildError 
+        if the base commit is not found
+        """
+        import git
+        # query git repo for the changes since the last rendered commit
+        base = base or tmp_cache.commit
+        try:
+            base_commit = repo.commit(base) if base else head_commit.parents[0]
+        except (ValueError, git.BadName, git.BadObject):
+            raise common.NeedsRebuildError("commit '%s' not found" % base)
+        pending = self._pending_queue(rebuild=False)
+        due = pending is not None and pending.due()
+        if base_commit == head_commit and not reconcile and not due:
+            common.log.info("workflow: nothing to update")
+            return base_commit, None
+        git_diff = head_commit.diff(base_commit)
+        common.log.info("workflow: found %d changes in git" % len(git_diff))
+        # build renderset
+        what = renderset.Update(self.config, tmp_cache, self.converter)
+        what.pending = pending
+        what.tree = head_commit.tree
+        if self.page_tree is not None:
+            self.page_tree.begin_run(rebuild=False)
+            what.page_tree = self.page_tree
+        if self.config.updated_from_git:
+            what.read_modified_times(base_commit.hexsha, head_commit.hexsha)
+        if reconcile:
+            git_diff = what.reconcile(git_diff, head_commit.tree)
+        if due:
+            git_diff = list(git_diff) + what.due_changes(git_diff, 
+                                                         head_commit.tree)
+        what.patch(git_diff)
+        if self.media is not None:
+            self.media.begin_run(rebuild=False)
+            changed = self.media.changed_files()
+            what.patch_media(self.media.pages_referencing(changed))
+        return base_commit, what
+    
+    def retag(self, old_tags, new_tag, message):
+        """ workflow for merging tags into a new tag 
+        
+        the tags headers of the blog posts are rewritten and committed with
+        the message, only the pages showing the tags of the blog posts are 
+        rendered, see renderset.Retag. the site is updated first, so the 
+        cache matches the head commit. returns False if no blog post was 
+        rewritten
+        """
+        self.update()
+        tmp_cache = self._load_cache()
+        pending = self._pending_queue(rebuild=False)
+        self.errors = []
+        what = renderset.Retag(self.config, tmp_cache, self.converter)
+        what.pending = pending
+        paths = what.rewrite(old_tags, new_tag)
+        if not paths:
+            common.log.info("workflow: no blog posts to retag")
+            if self.keep_cache:
+                self.cache = tmp_cache
+            self._write_error_report(what.errors)
+            return False
+        subprocess.check_call(["git", "commit", "-q", "-m", message, "--"] +
+                              paths)
+        base_commit, tmp_cache.commit = tmp_cache.commit, self._head_commit()
+        if self.config.updated_from_git:
+            what.read_modified_times(base_commit)
+        search_index = self._search_index(rebuild=False)
+        if self.link_graph is not None:
+            self.link_graph.begin_run(rebuild=False)
+        if self.media is not None:
+            self.media.begin_run(rebuild=False)
+        if self.page_tree is not None:
+            self.page_tree.begin_run(rebuild=False)
+        what.patch()
+        self._apply(what, tmp_cache, search_index)
+        return True
+    
+    def _apply(self, what, tmp_cache, search_index):
+        """ deletes and renders the items of an update renderset, stores the
+        changed state and finishes the run, see _finish_run
+        """
+        # first delete old items, than render the new ones
+        for item in what.items_to_delete():
+            self.delete(item)
+            if search_index:
+                search_index.remove(item)
+        for item in what.items_to_render():
+            if self._render_item(item):
+                what.rendered(item)
+            if search_index:
+                search_index.add(item)
+        # write update cache back to file and clean empty direcotries
+        tmp_cache.write(self.config.cache_dir)
+        if search_index:
+            search_index.write(self.config.search_cache_path)
+        self._write_converter_cache()
+        self._write_media()
+        self._write_page_tree()
+        self._write_pending(what.pending)
+        self._write_timings()
+        self._clean_empty_directories()
+        self._log_peak_memory_usage()
+        if self.keep_cache:
+            self.cache = tmp_cache
+        self._write_error_report(what.errors)
+        self._finish_run(tmp_cache.commit)
+    
+    def _head_commit(self):
+        """ returns the sha of the head commit or None if not in a git repo """
+        import git
         try:
-            # query git repo for the changes in the last commit
-            repo = git.Repo(".")
-            head_commit = repo.head.commit
-            parent_commit = head_commit.parents[0]
-            git_diff = head_commit.diff(parent_commit)
-            common.log.info("workflow: found %d changes in git" % len(git_diff))
-            # load cache and build renderset
-            tmp_cache = cache.BlogCache.from_file(self.config.cache_path)
-            what = renderset.Update(self.config, tmp_cache)
-            what.patch(git_diff)
-            # first delete old items, than render the new ones
-            for item in what.items_to_delete():
-                self.delete(item)
-            for item in what.items_to_render():
-                self.render(item)
-            # write update cache back to file and clean empty direcotries
-            tmp_cache.write(self.config.cache_path)
-            self._clean_empty_directories()
-        except common.NeedsRebuildError, e:
-            # if a cache error occurs or a template has changed, we need to 
-            # rebuild the site
-            common.log.warn(" %s, issuing rebuild" % e.message)
-            self.rebuild()
+            return git.Repo(".").head.commit.hexsha
+        except (git.InvalidGitRepositoryError, ValueError):
+            common.log.warn("workflow: could not find the head commit")
+            return None
+    
+    def _search_index(self, rebuild):
+        """ returns the search index if enabled in the settings, or None
+        
+        on a rebuild a fresh index is returned, otherwise the stored state is
+        loaded and a NeedsRebuildError is raised if this is not possible
+        """
+        if not self.config.search_index:
+            return None
+        if rebuild:
+            search_index = search.SearchIndex(self.config, self.delta)
+            search_index.clear()
+            return search_index
+        return search.SearchIndex.from_file(self.config, 
+                                            self.config.search_cache_path,
+                                            self.delta)
+    
+    def _load_cache(self):
+        """ returns the cache kept in memory or loads the stored cache
+        
+        the cache in memory is taken only once. it is dropped if the stored
+        cache was written by another process since, e.g. by a rebuild 
+        outside of the render daemon
+        """
+        tmp_cache, self.cache = self.cache, None
+        if tmp_cache is not None and \
+           tmp_cache.is_stale(self.config.cache_dir):
+            common.log.info("workflow: the stored cache has changed")
+            tmp_cache = None
+        if tmp_cache is None:
+            tmp_cache = cache.BlogCache.from_file(self.config.cache_dir)
+        return tmp_cache
+    
+    def _pending_queue(self, rebuild):
+        """ returns the queue of scheduled blog posts if enabled, or None
+        
+        on a rebuild an empty queue is returned, otherwise the stored queue
+        """
+        if not self.config.scheduled_publishing:
+            return None
+        from . import schedule
+        if rebuild:
+            return schedule.PendingQueue()
+        return schedule.PendingQueue.from_file(self.config.pending_path)
+    
+    def _render_item(self, item):
+        """ renders a content item and records the written file 
+        
+        an item that can not be rendered is recorded as an error and does not
+        stop the run, returns False in this case
+        """
+        start = time.time()
+        try:
+            self.render(item)
+        except Exception, e:
+            message = "%s: %s" % (type(e).__name__, e)
+            common.log.warn("workflow: could not render '%s', %s" %\
+                            (item.id, message))
+            self.errors.append( (item.id, message) )
+            return False
+        if self.timings is not None:
+            self.timings.record(item, time.time() - start)
+        if self.delta is not None:
+            self.delta.add_written(os.path.join(self.config.deploy_dir, 
+                                                *item.get_url_parts()))
+        return True
+    
+    def _restore_item(self, item):
+        """ records an item rendered before the last checkpoint as rendered """
+        sub_path_parts = item.get_url_parts()
+        if self.link_graph is not None:
+            self.link_graph.restore_page("/" + "/".join(sub_path_parts))
+        if self.delta is not None:
+            self.delta.add_written(os.path.join(self.config.deploy_dir, 
+                                                *sub_path_parts))
     
     def delete(self, item):
         """ deletes a deployed content item """
@@ -183,6 +615,105 @@ class Workflow(object):
         common.log.info("workflow: deleting '%s'" % deploy_path)
         if os.path.isfile(deploy_path):
             os.remove(deploy_path)
+            if self.delta is not None:
+                self.delta.add_deleted(deploy_path)
+        if self.link_graph is not None:
+            self.link_graph.delete_page("/" + "/".join(sub_path_parts))
+        if self.media is not None:
+            self.media.delete_page(item)
+        if self.page_tree is not None:
+            self.page_tree.delete_page(item)
+    
+    def _finish_run(self, commit, rebuild=False):
+        """ checks the links and writes the delta bundle of a run
+        
+        if the link check fails, no bundle is written and the changed files
+        are held back for the next bundle, so broken pages are not replicated
+        """
+        try:
+            self._check_links()
+        except common.BrokenLinksError:
+            if self.delta is not None:
+                self.delta.hold()
+            raise
+        self._write_delta(commit, rebuild)
+    
+    def _check_links(self):
+        """ checks the links of the rendered pages, if enabled 
+        
+        the link graph is written first, so the next update knows all links
+        even if this run fails. raises a gitwig.common.BrokenLinksError if 
+        broken links are found and the check is set to "fail"
+        """
+        if self.link_graph is None or not self.config.link_check:
+            return
+        self.link_graph.write(self.config.link_graph_path)
+        broken = self.link_graph.check()
+        self.link_graph.write_report(broken, self.config.link_report_path)
+        if broken and self.config.link_check == "fail":
+            raise common.BrokenLinksError("%d pages with broken links, see "\
+                                          "'%s'" % (len(broken),
+                                          self.config.link_report_path))
+    
+    def _write_error_report(self, load_errors):
+        """ writes the items that could not be loaded or rendered to the
+        error report, the report is removed if there were no errors 
+        """
+        errors = list(load_errors) + self.errors
+        report_path = self.config.error_report_path
+        if not errors:
+            if os.path.isfile(report_path):
+                os.remove(report_path)
+            return
+        file_handle = open(report_path, "w")
+        for id, message in errors:
+            line = "%s: %s\n" % (id, message)
+            if isinstance(line, unicode):
+                line = line.encode("utf-8")
+            file_handle.write(line)
+        file_handle.close()
+        common.log.warn("workflow: %d items failed, see '%s'" %\
+                        (len(errors), report_path))
+    
+    def _write_converter_cache(self):
+        """ persists the caches of the converter, see MarkdownConverter """
+        write_cache = getattr(self.converter, "write_cache", None)
+        if write_cache is not None:
+            write_cache()
+    
+    def _write_media(self):
+        """ persists the media digests and references, if used """
+        if self.media is not None:
+            self.media.write(self.config.media_cache_path)
+    
+    def _write_page_tree(self):
+        """ persists the tree of the static pages, if used """
+        if self.page_tree is not None:
+            self.page_tree.write(self.config.page_tree_path)
+    
+    def _write_pending(self, pending):
+        """ persists the queue of scheduled blog posts, if used """
+        if pending is not None:
+            pending.write(self.config.pending_path)
+            next_due = pending.next_due()
+            if next_due:
+                common.log.info("workflow: %d scheduled blog posts, the next "\
+                                "at %s" % (len(pending), next_due))
+    
+    def _write_timings(self):
+        """ persists the render times of the item types, if recorded """
+        if self.timings is not None:
+            self.timings.write(self.config.render_timings_path)
+    
+    def _write_delta(self, commit, rebuild=False):
+        """ writes a delta bundle of the changed files, if enabled """
+        if self.delta is not None:
+            self.delta.write(commit, rebuild)
+    
+    def _log_peak_memory_usage(self):
+        """ reports the peak memory usage of the workflow """
+        common.log.info("workflow: peak memory usage %d kB" %\
+                        common.peak_memory_usage())
     
     def _clean_empty_directories(self):
         """ removes empty directories in the deploy directory """
@@ -201,15 +732,14 @@ class Workflow(object):
                 os.rmdir(dir)
 
 
-def serve(directory="."):
+def serve(directory=".", port=8000):
     """ quick helper function to start a http server """
     import SimpleHTTPServer
     import SocketServer
-    import os
 
     os.chdir(directory)
 
-    PORT = 8000
+    PORT = port
     handler = SimpleHTTPServer.SimpleHTTPRequestHandler
 
     httpd = None
@@ -0,0 +1,216 @@
+""" memoized pygments highlighting for the codehilite markdown extension
+
+the html of highlighted code blocks is cached by the options of the
+highlighter and the text of the code block, so unchanged code blocks are not
+lexed and formatted again. the cache is persisted between runs, the least
+recently used entries are evicted. pygments lexers are looked up once by name
+and reused.
+fenced code blocks are highlighted by the fenced_code extension itself, its
+preprocessor is replaced too.
+"""
+
+# global imports
+import collections
+import functools
+import hashlib
+try:
+    import cPickle as pickle
+except ImportError:
+    # fallback
+    import pickle
+from markdown.extensions import codehilite
+from markdown.extensions import fenced_code
+
+# local imports
+from . import common
+
+
+class HighlightCache(object):
+    """ persistent least recently used cache of highlighted code blocks """
+
+    def __init__(self, max_entries=10000):
+        """ initialization """
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        # pygments lexers by name, not persisted
+        self.lexers = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def install(self, markdown_instance):
+        """ replaces the codehilite tree processor and the preprocessor of 
+        the fenced_code extension of a markdown instance
+
+        nothing is done if the codehilite extension is not used
+        """
+        hiliter = markdown_instance.treeprocessors.get("hilite")
+        if hiliter is None:
+            common.log.debug("highlight: codehilite extension not found")
+            return
+        cached_hiliter = CachedHiliteTreeprocessor(markdown_instance, self)
+        cached_hiliter.config = hiliter.config
+        markdown_instance.treeprocessors["hilite"] = cached_hiliter
+        if "fenced_code_block" in markdown_instance.preprocessors:
+            markdown_instance.preprocessors["fenced_code_block"] = \
+                CachedFencedBlockPreprocessor(markdown_instance, self)
+
+    def get(self, key):
+        """ returns the cached html for a key or None """
+        html = self.entries.pop(key, None)
+        if html is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            # the most recently used entry is stored at the end
+            self.entries[key] = html
+        return html
+
+    def set(self, key, html):
+        """ stores the html for a key, evicts the least recently used """
+        self.entries[key] = html
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get_lexer(self, name, guess_source=None):
+        """ returns a pygments lexer by name
+
+        if no lexer is found and a source is given, the lexer is guessed.
+        the text lexer is used as a fallback
+        """
+        from pygments.lexers import get_lexer_by_name, guess_lexer
+        from pygments.util import ClassNotFound
+        if name in self.lexers:
+            return self.lexers[name]
+        try:
+            lexer = get_lexer_by_name(name or "")
+            self.lexers[name] = lexer
+            return lexer
+        except ClassNotFound:
+            pass
+        if guess_source is not None:
+            try:
+                return guess_lexer(guess_source)
+            except ClassNotFound:
+                pass
+        return self.get_lexer("text")
+
+    def write(self, cache_path):
+        """ writes the cache to a file """
+        common.log.info("highlight: %d hits, %d misses, writing %d entries" %\
+                        (self.hits, self.misses, len(self.entries)))
+        file_handle = open(cache_path, "wb")
+        pickle.dump(self.entries, file_handle, pickle.HIGHEST_PROTOCOL)
+        file_handle.close()
+
+    def load(self, cache_path):
+        """ loads the cache from a file, starts empty if this fails """
+        try:
+            file_handle = open(cache_path, "rb")
+            entries = pickle.load(file_handle)
+            file_handle.close()
+            if not isinstance(entries, collections.OrderedDict):
+                raise TypeError("unknown format")
+            self.entries = entries
+        except (IOError, EOFError, ValueError, TypeError, pickle.PickleError):
+            common.log.info("highlight: could not load '%s'" % cache_path)
+            self.entries = collections.OrderedDict()
+
+    @classmethod
+    def from_file(cls, cache_path, max_entries=10000):
+        """ returns an instance and loads the cache from file in one go """
+        instance = cls(max_entries)
+        instance.load(cache_path)
+        return instance
+
+
+class CachedCodeHilite(codehilite.CodeHilite):
+    """ code highlighter using a HighlightCache """
+
+    def __init__(self, highlight_cache, *args, **kwargs):
+        """ initialization, see codehilite.CodeHilite for the arguments """
+        super(CachedCodeHilite, self).__init__(*args, **kwargs)
+        self.highlight_cache = highlight_cache
+
+    def hilite(self):
+        """ returns the html of the code block, from cache if possible """
+        options = (self.lang, self.linenums, self.guess_lang, self.css_class,
+                   self.style, self.noclasses, self.tab_length,
+                   self.use_pygments, self.hl_lines)
+        key = hashlib.md5(repr( (options, self.src) )).hexdigest()
+        html = self.highlight_cache.get(key)
+        if html is None:
+            html = self._hilite()
+            self.highlight_cache.set(key, html)
+        return html
+
+    def _hilite(self):
+        """ highlights the code block with a reused lexer """
+        from pygments import highlight
+        from pygments.formatters import get_formatter_by_name
+        if not (codehilite.pygments and self.use_pygments):
+            return super(CachedCodeHilite, self).hilite()
+        self.src = self.src.strip("\n")
+        if self.lang is None:
+            self._parseHeader()
+        guess_source = self.src if self.guess_lang else None
+        lexer = self.highlight_cache.get_lexer(self.lang, guess_source)
+        formatter = get_formatter_by_name("html",
+                                          linenos=self.linenums,
+                                          cssclass=self.css_class,
+                                          style=self.style,
+                                          noclasses=self.noclasses,
+                                          hl_lines=self.hl_lines)
+        return highlight(self.src, lexer, formatter)
+
+
+class CachedHiliteTreeprocessor(codehilite.HiliteTreeprocessor):
+    """ codehilite tree processor using a HighlightCache """
+
+    def __init__(self, markdown_instance, highlight_cache):
+        """ initialization """
+        codehilite.HiliteTreeprocessor.__init__(self, markdown_instance)
+        self.highlight_cache = highlight_cache
+
+    def run(self, root):
+        """ finds code blocks and stores the highlighted html in the stash """
+        for block in root.iter("pre"):
+            if len(block) == 1 and block[0].tag == "code":
+                code = CachedCodeHilite(
+                    self.highlight_cache,
+                    block[0].text,
+                    linenums=self.config["linenums"],
+                    guess_lang=self.config["guess_lang"],
+                    css_class=self.config["css_class"],
+                    style=self.config["pygments_style"],
+                    noclasses=self.config["noclasses"],
+                    tab_length=self.markdown.tab_length,
+                    use_pygments=self.config["use_pygments"])
+                placeholder = self.markdown.htmlStash.store(code.hilite(),
+                                                            safe=True)
+                # the code block is replaced by a paragraph with the
+                # placeholder, see codehilite.HiliteTreeprocessor
+                block.clear()
+                block.tag = "p"
+                block.text = placeholder
+
+
+class CachedFencedBlockPreprocessor(fenced_code.FencedBlockPreprocessor):
+    """ fenced_code preprocessor highlighting with a HighlightCache """
+
+    def __init__(self, markdown_instance, highlight_cache):
+        """ initialization """
+        fenced_code.FencedBlockPreprocessor.__init__(self, markdown_instance)
+        self.highlight_cache = highlight_cache
+
+    def run(self, lines):
+        """ stores the fenced code blocks in the stash, highlighted by a
+        CachedCodeHilite
+        """
+        # the preprocessor creates its highlighters by the module name
+        original = fenced_code.CodeHilite
+        fenced_code.CodeHilite = functools.partial(CachedCodeHilite,
+                                                   self.highlight_cache)
+        try:
+            return fenced_code.FencedBlockPreprocessor.run(self, lines)
+        finally:
+            fenced_code.CodeHilite = original
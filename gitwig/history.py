@@ -0,0 +1,45 @@
+""" last modification times of source files from the git history
+
+the times are read in a single walk of the git log instead of one query per
+file. a rebuild walks the complete history, an update only the commits since
+the last rendered one.
+"""
+
+# global imports
+import datetime
+import subprocess
+
+# local imports
+from . import common
+
+# marker of a commit line in the git log output
+COMMIT_MARKER = "\x00"
+
+
+def modified_times(paths, since=None, until="HEAD"):
+    """ returns a dict of file paths and the time of the last commit
+    changing them
+
+    paths:
+        the files or directories to look at
+    since:
+        optional sha of a commit, only later commits are walked
+    """
+    revisions = until if since is None else "%s..%s" % (since, until)
+    command = ["git", "-c", "core.quotepath=off", "log", "--format=%x00%at",
+               "--name-only", revisions, "--"] + list(paths)
+    try:
+        output = subprocess.check_output(command)
+    except (OSError, subprocess.CalledProcessError), e:
+        common.log.warn("history: could not read the git log, %s" % e)
+        return dict()
+    times, timestamp = dict(), None
+    # the log is ordered by date, the newest commit first
+    for line in output.decode("utf-8").splitlines():
+        if line.startswith(COMMIT_MARKER):
+            timestamp = int(line[len(COMMIT_MARKER):])
+        elif line and line not in times:
+            times[line] = datetime.datetime.fromtimestamp(timestamp)
+    common.log.info("history: found modification times of %d files" %\
+                    len(times))
+    return times
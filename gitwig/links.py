@@ -0,0 +1,150 @@
+""" incremental checking of internal links in the rendered pages
+
+the links are collected from the genshi streams while the pages are rendered
+and stored in a persistent link graph (page -> link targets). after a run
+only the rendered pages and the pages linking to deleted pages are checked.
+"""
+
+# global imports
+import os
+import posixpath
+import urlparse
+try:
+    import cPickle as pickle
+except ImportError:
+    # fallback
+    import pickle
+
+# local imports
+from . import common
+
+
+class LinkGraph(object):
+    """ persistent graph of the internal links of the rendered pages """
+
+    def __init__(self, config):
+        """ initialization """
+        self.config = config
+        # page url -> set of link targets
+        self.links = dict()
+        # pages rendered and deleted in the current run
+        self.rendered = set()
+        self.deleted = set()
+        self.current_page = None
+
+    def begin_run(self, rebuild):
+        """ prepares a new run, loads the stored graph for an update """
+        self.links = dict()
+        self.rendered, self.deleted = set(), set()
+        if not rebuild:
+            self.load(self.config.link_graph_path)
+
+    def begin_page(self, url):
+        """ starts collecting the links of a page """
+        self.current_page = url
+        self.links[url] = set()
+        self.rendered.add(url)
+
+    def restore_page(self, url):
+        """ marks a page rendered by an interrupted run as rendered 
+        
+        its links are already known from the checkpoint of the run
+        """
+        self.rendered.add(url)
+
+    def delete_page(self, url):
+        """ removes a deleted page from the graph """
+        self.links.pop(url, None)
+        self.deleted.add(url)
+
+    def add_link(self, href):
+        """ adds a link found on the current page, external links are ignored
+        """
+        target = self.resolve(href)
+        if target is not None and self.current_page is not None:
+            self.links[self.current_page].add(target)
+
+    def resolve(self, href):
+        """ returns the target of a link as a site url or a media url
+
+        media urls start with "media:", external links return None
+        """
+        media_prefix = self.config.media_prefix.rstrip("/") + "/"
+        url_prefix = self.config.url_prefix.rstrip("/")
+        if href.startswith(media_prefix):
+            return "media:" + href[len(media_prefix):].split("?")[0]
+        if url_prefix and (href == url_prefix or \
+                           href.startswith(url_prefix + "/")):
+            href = href[len(url_prefix):] or "/"
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(href)
+        if scheme or netloc or not path:
+            # external links, mail links and links within the page
+            return None
+        if not path.startswith("/"):
+            base = posixpath.dirname(self.current_page or "/")
+            path = posixpath.join(base, path)
+        target = posixpath.normpath(path)
+        if path.endswith("/"):
+            target = posixpath.join(target, "index.html")
+        return target
+
+    def exists(self, target):
+        """ checks if a link target exists in the deploy or media directory """
+        if target.startswith("media:"):
+            return os.path.isfile(os.path.join(self.config.media_dir,
+                                               target[len("media:"):]))
+        for prefix in self.config.link_check_ignore:
+            if target.startswith(prefix):
+                return True
+        path = os.path.join(self.config.deploy_dir, target.lstrip("/"))
+        if os.path.isdir(path):
+            path = os.path.join(path, "index.html")
+        return os.path.isfile(path)
+
+    def check(self):
+        """ returns a dict of pages and their broken links
+
+        only the pages rendered in this run and pages linking to deleted
+        pages are checked
+        """
+        to_check = set(self.rendered)
+        if self.deleted:
+            for page, targets in self.links.iteritems():
+                if not targets.isdisjoint(self.deleted):
+                    to_check.add(page)
+        common.log.info("links: checking %d pages" % len(to_check))
+        broken = dict()
+        for page in to_check:
+            missing = [t for t in self.links.get(page, ())
+                       if not self.exists(t)]
+            if missing:
+                broken[page] = sorted(missing)
+        return broken
+
+    def write_report(self, broken, report_path):
+        """ logs the broken links and writes them to a report file """
+        file_handle = open(report_path, "w")
+        for page in sorted(broken):
+            for target in broken[page]:
+                common.log.warn("links: broken link on '%s' to '%s'" %\
+                                (page, target))
+                file_handle.write("%s -> %s\n" % (page, target))
+        file_handle.close()
+        common.log.info("links: %d pages with broken links" % len(broken))
+
+    def write(self, link_graph_path):
+        """ writes the link graph to a file """
+        file_handle = open(link_graph_path, "wb")
+        pickle.dump(self.links, file_handle, pickle.HIGHEST_PROTOCOL)
+        file_handle.close()
+
+    def load(self, link_graph_path):
+        """ loads the link graph from a file, starts empty if this fails """
+        try:
+            file_handle = open(link_graph_path, "rb")
+            self.links = pickle.load(file_handle)
+            file_handle.close()
+        except (IOError, EOFError, pickle.PickleError):
+            common.log.info("links: could not load '%s', only rendered "\
+                            "pages will be checked" % link_graph_path)
+            self.links = dict()
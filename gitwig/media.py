@@ -0,0 +1,137 @@
+""" content hashed urls for the files in the static media directory
+
+the urls of media files get the digest of their content as a version, so the
+media directory can be served with far future cache headers. the digests are
+cached by the modification time and size of the files, so a file is only
+hashed again if it has changed. for every rendered page the referenced media
+files are stored, so an update only renders the pages referencing a changed
+media file.
+"""
+
+# global imports
+import hashlib
+import os
+try:
+    import cPickle as pickle
+except ImportError:
+    # fallback
+    import pickle
+
+# local imports
+from . import common
+
+# number of hex digits of the digest used in an url
+VERSION_LENGTH = 10
+
+
+class MediaFingerprints(object):
+    """ persistent digests of media files and the pages referencing them """
+
+    def __init__(self, config):
+        """ initialization """
+        self.config = config
+        # media file name -> (modification time, size, digest or None)
+        self.files = dict()
+        # page key -> set of referenced media file names, see 
+        # gitwig.common.item_key. pages without media files are left out
+        self.pages = dict()
+        # media files checked in the current run and the current page
+        self.checked = set()
+        self.current_page = None
+
+    def begin_run(self, rebuild):
+        """ prepares a new run, loads the stored data for an update
+
+        the digests of the files are kept on a rebuild, they are checked
+        against the files anyway
+        """
+        self.checked = set()
+        if rebuild:
+            self.pages = dict()
+        else:
+            self.load(self.config.media_cache_path)
+
+    def begin_page(self, item):
+        """ starts collecting the media references of a content item """
+        self.current_page = common.item_key(item)
+        self.pages.pop(self.current_page, None)
+
+    def url(self, name):
+        """ returns the versioned url of a media file and records its use """
+        if self.current_page is not None:
+            self.pages.setdefault(self.current_page, set()).add(name)
+        digest = self.digest(name)
+        url = self.config.media_prefix + "/" + name
+        if digest is None:
+            common.log.warn("media: file '%s' not found" % name)
+            return url
+        return "%s?v=%s" % (url, digest[:VERSION_LENGTH])
+
+    def digest(self, name):
+        """ returns the digest of a media file or None if it does not exist
+
+        the file is only hashed if its modification time or size changed
+        """
+        if name in self.checked:
+            return self.files[name][2]
+        self.checked.add(name)
+        path = os.path.join(self.config.media_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.files[name] = (None, None, None)
+            return None
+        mtime, size, digest = self.files.get(name, (None, None, None))
+        if (mtime, size) != (stat.st_mtime, stat.st_size) or digest is None:
+            common.log.debug("media: hashing '%s'" % name)
+            md5 = hashlib.md5()
+            file_handle = open(path, "rb")
+            for chunk in iter(lambda: file_handle.read(64 * 1024), ""):
+                md5.update(chunk)
+            file_handle.close()
+            digest = md5.hexdigest()
+        self.files[name] = (stat.st_mtime, stat.st_size, digest)
+        return digest
+
+    def changed_files(self):
+        """ returns the names of referenced media files with a new digest
+
+        files that were never referenced by a page are not checked
+        """
+        changed = set()
+        for name, (mtime, size, digest) in self.files.items():
+            if self.digest(name) != digest:
+                changed.add(name)
+        common.log.info("media: %d changed files" % len(changed))
+        return changed
+
+    def pages_referencing(self, names):
+        """ returns the keys of all pages referencing one of the media files """
+        return set(key for key, referenced in self.pages.iteritems()
+                   if not referenced.isdisjoint(names))
+
+    def delete_page(self, item):
+        """ forgets the media references of a deleted content item """
+        self.pages.pop(common.item_key(item), None)
+
+    def write(self, media_cache_path):
+        """ writes the digests and references to a file """
+        file_handle = open(media_cache_path, "wb")
+        pickle.dump( (self.files, self.pages), file_handle,
+                     pickle.HIGHEST_PROTOCOL)
+        file_handle.close()
+
+    def load(self, media_cache_path):
+        """ loads the digests and references from a file
+
+        will raise a gitwig.common.NeedsRebuildError if the file could not be
+        opened or the data could not be unpickled, without the references the
+        pages using a changed file are unknown
+        """
+        try:
+            file_handle = open(media_cache_path, "rb")
+            self.files, self.pages = pickle.load(file_handle)
+            file_handle.close()
+        except (IOError, EOFError, ValueError, pickle.PickleError):
+            raise common.NeedsRebuildError("could not load media digests "\
+                                           "from '%s'" % media_cache_path)
@@ -0,0 +1,125 @@
+""" minification of the genshi streams before serialization
+
+comments are removed and whitespace is collapsed. whitespace only text next
+to block level elements is dropped. the content of pre, code, textarea, script
+and style elements is kept as it is, also in converted content inserted as
+markup. in xml streams only whitespace between elements is dropped, the text
+of an element is only minified if it is escaped html marked by a type="html"
+attribute like in an atom feed.
+"""
+
+# global imports
+import re
+from genshi.core import COMMENT, END, START, TEXT, Markup
+
+# elements with whitespace sensitive content
+PRESERVE_TAGS = frozenset(["pre", "code", "textarea", "script", "style"])
+# elements where surrounding whitespace is not displayed
+BLOCK_TAGS = frozenset(["html", "head", "body", "title", "meta", "link",
+                        "script", "style", "div", "p", "ul", "ol", "li", "dl",
+                        "dt", "dd", "table", "thead", "tbody", "tfoot", "tr",
+                        "th", "td", "h1", "h2", "h3", "h4", "h5", "h6",
+                        "header", "footer", "nav", "section", "article",
+                        "aside", "main", "blockquote", "figure", "figcaption",
+                        "form", "hr", "br", "pre"])
+
+# regular expressions for minifying markup
+regex_whitespace = re.compile(r"\s+", re.UNICODE)
+regex_comments = re.compile(r"<!--.*?-->", re.DOTALL)
+regex_preserved = re.compile(r"<(pre|code|textarea|script|style)\b.*?</\1\s*>",
+                             re.DOTALL | re.IGNORECASE)
+
+
+def minify_markup(text):
+    """ removes comments and collapses whitespace in a html string
+
+    the content of whitespace sensitive elements is not changed
+    """
+    text = regex_comments.sub(u"", text)
+    parts, position = [], 0
+    for match in regex_preserved.finditer(text):
+        parts.append(regex_whitespace.sub(u" ", text[position:match.start()]))
+        parts.append(match.group(0))
+        position = match.end()
+    parts.append(regex_whitespace.sub(u" ", text[position:]))
+    return u"".join(parts)
+
+
+class MinifyFilter(object):
+    """ genshi stream filter removing comments and whitespace """
+
+    def __init__(self, method="html"):
+        """ initialization
+
+        method:
+            the serialization method, "html" or "xml"
+        """
+        self.is_html = method == "html"
+        # number of removed characters, for measuring the effect
+        self.removed = 0
+
+    def __call__(self, stream):
+        """ generator of the minified stream events """
+        # depth of whitespace sensitive elements
+        preserve = 0
+        # whitespace only text waiting for the next event
+        pending = None
+        # the last event was a start or end of a block level element
+        after_block = True
+        # the text is escaped html in a xml stream
+        html_text = False
+        for kind, data, pos in stream:
+            if kind is COMMENT:
+                self.removed += len(data) + 7
+                continue
+            if kind is TEXT and not preserve:
+                length = len(data)
+                data = self._minify_text(data, html_text)
+                self.removed += length - len(data)
+                if not data.strip():
+                    if not after_block:
+                        pending = (kind, data, pos)
+                    else:
+                        self.removed += len(data)
+                    continue
+            is_block = self._is_block(kind, data)
+            if pending is not None:
+                if not is_block:
+                    yield pending
+                else:
+                    self.removed += len(pending[1])
+                pending = None
+            if kind is START:
+                html_text = data[1].get("type") == "html"
+                if data[0].localname in PRESERVE_TAGS:
+                    preserve += 1
+            elif kind is END:
+                html_text = False
+                if data.localname in PRESERVE_TAGS:
+                    preserve -= 1
+            after_block = is_block
+            yield kind, data, pos
+
+    def _minify_text(self, data, html_text=False):
+        """ collapses the whitespace of a text event """
+        if isinstance(data, Markup):
+            return Markup(minify_markup(data)) if self.is_html else data
+        if html_text:
+            return minify_markup(data)
+        if not self.is_html:
+            # other text in xml is only dropped if it is whitespace
+            return data
+        return regex_whitespace.sub(u" ", data)
+
+    def _is_block(self, kind, data):
+        """ checks if an event is the start or end of a block level element
+
+        in xml all elements are handled like block level elements
+        """
+        if kind is START:
+            name = data[0].localname
+        elif kind is END:
+            name = data.localname
+        else:
+            return False
+        return not self.is_html or name in BLOCK_TAGS
@@ -0,0 +1,204 @@
+""" a persistent tree of the static pages, used for navigation in templates
+
+the static pages are grouped into sections by the directories of their urls,
+e.g. about/index.html and about/team.html are in the section ("about",), an
+index.html page is the index page of its section. templates look up the
+siblings, the parent and the subsections of a page in the tree instead of
+walking the page directory. for every rendered page the nodes of the tree it
+looked up are stored, so an update only renders the pages showing a changed
+node: a renamed page renders its siblings and the index page of the parent
+section. the nodes are:
+
+ -  ("entries", section): the pages in a section
+ -  ("index", section): the index page of a section
+ -  ("children", section): the subsections of a section
+"""
+
+# global imports
+import collections
+try:
+    import cPickle as pickle
+except ImportError:
+    # fallback
+    import pickle
+
+# local imports
+from . import common
+
+# the last url part of the index page of a section
+INDEX_NAME = "index.html"
+
+# a page in the tree, the url is the absolute url path of the page
+PageEntry = collections.namedtuple("PageEntry", "id url title")
+
+
+def url_key(entry):
+    """ sort key of the entries of a section """
+    return entry.url
+
+
+class PageTree(object):
+    """ persistent sections of the static pages and the pages using them """
+
+    def __init__(self, config):
+        """ initialization """
+        self.config = config
+        self._reset()
+        # nodes changed in the current run and the current page
+        self.changed = set()
+        self.current_page = None
+        # section -> entries sorted by url, built on the first lookup
+        self.sorted = dict()
+
+    def _reset(self):
+        """ resets the tree and the dependencies """
+        # section -> {last url part: PageEntry}, a section is a tuple of the
+        # directory names of the url
+        self.sections = dict()
+        # section -> set of its direct subsections
+        self.children = dict()
+        # page id -> (section, last url part)
+        self.pages = dict()
+        # page key -> set of nodes looked up by the page, see
+        # gitwig.common.item_key. pages without lookups are left out
+        self.dependencies = dict()
+
+    def begin_run(self, rebuild):
+        """ prepares a new run, loads the stored tree for an update """
+        self.changed = set()
+        self.current_page = None
+        self.sorted = dict()
+        if rebuild:
+            self._reset()
+        else:
+            self.load(self.config.page_tree_path)
+
+    def begin_page(self, item):
+        """ starts collecting the nodes looked up by a content item """
+        self.current_page = common.item_key(item)
+        self.dependencies.pop(self.current_page, None)
+
+    def delete_page(self, item):
+        """ forgets the nodes looked up by a deleted content item """
+        self.dependencies.pop(common.item_key(item), None)
+
+    def set_page(self, page):
+        """ adds a static page to the tree or updates its title """
+        parts = page.get_url_parts()
+        section, name = tuple(parts[:-1]), parts[-1]
+        entry = PageEntry(page.id, "/" + "/".join(parts),
+                          page.headers.get("title"))
+        entries = self.sections.get(section)
+        if entries is None:
+            entries = self.sections[section] = dict()
+            if section:
+                self.children.setdefault(section[:-1], set()).add(section)
+                self._changed("children", section[:-1])
+        if entries.get(name) != entry:
+            entries[name] = entry
+            self.pages[page.id] = (section, name)
+            self._changed_entry(section, name)
+
+    def remove_page(self, id):
+        """ removes a static page from the tree """
+        if id not in self.pages:
+            return
+        section, name = self.pages.pop(id)
+        entries = self.sections[section]
+        del entries[name]
+        self._changed_entry(section, name)
+        if not entries:
+            del self.sections[section]
+            if section:
+                self.children[section[:-1]].discard(section)
+                self._changed("children", section[:-1])
+
+    def _changed_entry(self, section, name):
+        """ marks the nodes showing an entry of a section as changed """
+        self._changed("entries", section)
+        if name == INDEX_NAME:
+            self._changed("index", section)
+
+    def _changed(self, kind, section):
+        """ marks a node as changed """
+        self.changed.add( (kind, section) )
+        if kind == "entries":
+            self.sorted.pop(section, None)
+
+    def pages_depending(self, nodes):
+        """ returns the keys of all pages that looked up one of the nodes """
+        return set(key for key, used in self.dependencies.iteritems()
+                   if not used.isdisjoint(nodes))
+
+    def section(self, item):
+        """ returns the section of a content item """
+        return tuple(item.get_url_parts()[:-1])
+
+    def entries(self, section):
+        """ returns the entries of the pages in a section, sorted by url """
+        self._depend("entries", section)
+        if section not in self.sorted:
+            self.sorted[section] = sorted(self.sections.get(section,
+                                                            {}).values(),
+                                          key=url_key)
+        return self.sorted[section]
+
+    def index(self, section):
+        """ returns the entry of the index page of a section or None """
+        self._depend("index", section)
+        return self.sections.get(section, {}).get(INDEX_NAME)
+
+    def subsections(self, section):
+        """ returns the entries of the index pages of the direct subsections
+        of a section, sorted by url
+        """
+        self._depend("children", section)
+        entries = [self.index(s) for s in self.children.get(section, ())]
+        return sorted(filter(None, entries), key=url_key)
+
+    def siblings(self, item):
+        """ returns the entries of the pages in the section of an item """
+        return self.entries(self.section(item))
+
+    def parent(self, item):
+        """ returns the entry of the index page above an item or None
+
+        this is the index page of the section of the item, or of the parent
+        section for an index page
+        """
+        parts = item.get_url_parts()
+        section = tuple(parts[:-1])
+        if parts[-1] == INDEX_NAME:
+            if not section:
+                return None
+            section = section[:-1]
+        return self.index(section)
+
+    def _depend(self, kind, section):
+        """ records that the current page looked up a node """
+        if self.current_page is not None:
+            self.dependencies.setdefault(self.current_page, 
+                                         set()).add( (kind, section) )
+
+    def write(self, page_tree_path):
+        """ writes the tree and the dependencies to a file """
+        file_handle = open(page_tree_path, "wb")
+        pickle.dump( (self.sections, self.children, self.pages,
+                      self.dependencies), file_handle,
+                     pickle.HIGHEST_PROTOCOL)
+        file_handle.close()
+
+    def load(self, page_tree_path):
+        """ loads the tree and the dependencies from a file
+
+        will raise a gitwig.common.NeedsRebuildError if the file could not be
+        opened or the data could not be unpickled
+        """
+        try:
+            file_handle = open(page_tree_path, "rb")
+            self.sections, self.children, self.pages, self.dependencies = \
+                pickle.load(file_handle)
+            file_handle.close()
+        except (IOError, EOFError, ValueError, pickle.PickleError):
+            raise common.NeedsRebuildError("could not load the page tree "\
+                                           "from '%s'" % page_tree_path)
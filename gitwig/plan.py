@@ -0,0 +1,220 @@
+""" render plans: what a run would render and delete, without rendering
+
+the render time of every item type is recorded by the workflow and stored as
+a moving average in the timings file. a plan runs the logic of an update or a
+rebuild against a commit and estimates the time the run would take from these
+timings. the stored cache is not changed.
+"""
+
+# global imports
+import json
+
+# local imports
+from . import cache
+from . import common
+from . import renderset
+
+# weight of the last run in the moving average of the render times
+TIMING_WEIGHT = 0.3
+# seconds per item if no render times are recorded at all
+DEFAULT_SECONDS = 0.05
+
+
+def item_url(item):
+    """ returns the url path of a content item in the deploy directory """
+    return "/" + "/".join(item.get_url_parts())
+
+
+class RenderTimings(object):
+    """ average render times of the content item types """
+
+    def __init__(self):
+        """ initialization """
+        # type name -> average seconds per item
+        self.seconds = dict()
+        # type name -> [number of items, seconds] of the current run
+        self.run = dict()
+
+    def record(self, item, seconds):
+        """ records the render time of a content item """
+        entry = self.run.setdefault(type(item).__name__, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+    def estimate(self, type_name):
+        """ returns the estimated seconds per item of a type
+
+        types without recorded times are estimated by the average of all
+        recorded types
+        """
+        if type_name in self.seconds:
+            return self.seconds[type_name]
+        if self.seconds:
+            return sum(self.seconds.values()) / len(self.seconds)
+        return DEFAULT_SECONDS
+
+    def merge(self):
+        """ adds the render times of the current run to the averages """
+        for type_name, (count, seconds) in self.run.iteritems():
+            average = seconds / count
+            if type_name in self.seconds:
+                average = TIMING_WEIGHT * average + \
+                          (1 - TIMING_WEIGHT) * self.seconds[type_name]
+            self.seconds[type_name] = average
+        self.run = dict()
+
+    def write(self, timings_path):
+        """ merges the current run and writes the averages to a file """
+        self.merge()
+        file_handle = open(timings_path, "wb")
+        json.dump(self.seconds, file_handle, indent=1, sort_keys=True)
+        file_handle.close()
+
+    def load(self, timings_path):
+        """ loads the averages from a file, starts empty if this fails """
+        try:
+            file_handle = open(timings_path, "rb")
+            self.seconds = dict(json.load(file_handle))
+            file_handle.close()
+        except (IOError, ValueError, TypeError):
+            common.log.info("plan: no render timings found in '%s'" %\
+                            timings_path)
+            self.seconds = dict()
+
+    @classmethod
+    def from_file(cls, timings_path):
+        """ returns an instance and loads the averages from a file """
+        instance = cls()
+        instance.load(timings_path)
+        return instance
+
+
+class RenderPlan(object):
+    """ the items a run would render and delete """
+
+    def __init__(self, mode, head, base=None, reason=None):
+        """ initialization
+
+        mode:
+            "update" or "rebuild"
+        reason:
+            why a rebuild is needed, if it is one
+        """
+        self.mode = mode
+        self.head = head
+        self.base = base
+        self.reason = reason
+        self.to_render = []
+        self.to_delete = []
+        self.errors = []
+
+    def by_type(self, items):
+        """ returns a dict of type names and the sorted urls of the items """
+        grouped = dict()
+        for item in items:
+            grouped.setdefault(type(item).__name__, []).append(item_url(item))
+        for urls in grouped.itervalues():
+            urls.sort()
+        return grouped
+
+    def estimate(self, timings):
+        """ returns a dict of type names and the estimated render seconds """
+        return dict( (type_name, len(urls) * timings.estimate(type_name))
+                     for type_name, urls
+                     in self.by_type(self.to_render).iteritems() )
+
+    def as_dict(self, timings):
+        """ returns the plan as a dict, e.g. for the json output """
+        estimate = self.estimate(timings)
+        return {
+            "mode": self.mode,
+            "reason": self.reason,
+            "base": self.base,
+            "head": self.head,
+            "render": self.by_type(self.to_render),
+            "delete": self.by_type(self.to_delete),
+            "errors": [ {"id": id, "message": message}
+                        for id, message in self.errors ],
+            "estimate": {"total": sum(estimate.values()), "types": estimate} }
+
+    def as_json(self, timings):
+        """ returns the plan as a json string """
+        return json.dumps(self.as_dict(timings), indent=1, sort_keys=True)
+
+    def as_text(self, timings):
+        """ returns the plan as a human readable text """
+        estimate = self.estimate(timings)
+        if self.mode == "rebuild":
+            lines = ["rebuild of %s: %s" % (self.head[:7], self.reason)]
+        else:
+            lines = ["update %s..%s" % (self.base[:7], self.head[:7])]
+        lines.append("%d items to render, %d to delete, about %.2f s" %\
+                     (len(self.to_render), len(self.to_delete),
+                      sum(estimate.values())))
+        for title, items in (("render", self.to_render),
+                             ("delete", self.to_delete)):
+            grouped = self.by_type(items)
+            if grouped:
+                lines.append("%s:" % title)
+            for type_name in sorted(grouped):
+                urls = grouped[type_name]
+                if title == "render":
+                    lines.append("  %s: %d, %.2f s" % (type_name, len(urls),
+                                                       estimate[type_name]))
+                else:
+                    lines.append("  %s: %d" % (type_name, len(urls)))
+                lines.extend("    " + url for url in urls)
+        if self.errors:
+            lines.append("errors:")
+            lines.extend("  %s: %s" % error for error in self.errors)
+        return "\n".join(lines)
+
+
+def make_plan(workflow, head="HEAD", base=None):
+    """ returns the render plan for a commit
+
+    the changes between the base commit and the head commit are planned like
+    an update of the workflow, the base defaults to the last rendered commit.
+    if an update is not possible, a rebuild is planned; a rebuild reads the 
+    files in the working tree.
+    """
+    import git
+    config = workflow.config
+    repo = git.Repo(".")
+    head_commit = repo.commit(head)
+    reconcile = False
+    while True:
+        try:
+            return _update_plan(workflow, repo, head_commit, base, reconcile)
+        except common.CacheDriftError, e:
+            if reconcile:
+                return _rebuild_plan(config, head_commit, e.message)
+            reconcile = True
+        except common.NeedsRebuildError, e:
+            return _rebuild_plan(config, head_commit, e.message)
+
+def _update_plan(workflow, repo, head_commit, base=None, reconcile=False):
+    """ plans an update like gitwig.deploy.Workflow.update """
+    tmp_cache = cache.BlogCache.from_file(workflow.config.cache_dir)
+    base_commit, what = workflow.prepare_update(repo, tmp_cache, head_commit,
+                                                base, reconcile)
+    plan = RenderPlan("update", head_commit.hexsha, base_commit.hexsha)
+    if what is not None:
+        plan.to_delete = list(what.items_to_delete())
+        plan.to_render = list(what.items_to_render())
+        plan.errors = what.errors
+    return plan
+
+def _rebuild_plan(config, head_commit, reason):
+    """ plans a rebuild like gitwig.deploy.Workflow.rebuild """
+    plan = RenderPlan("rebuild", head_commit.hexsha, reason=reason)
+    what = renderset.Rebuild(config, cache.BlogCache())
+    if config.page_tree:
+        from . import pagetree
+        what.page_tree = pagetree.PageTree(config)
+    if config.scheduled_publishing:
+        from . import schedule
+        what.pending = schedule.PendingQueue()
+    plan.to_render = list(what.items_to_render())
+    plan.errors = what.errors
+    return plan
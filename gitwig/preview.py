@@ -0,0 +1,196 @@
+""" preview builds of other branches, sharing the caches of the main site
+
+a preview renders a git ref into its own directory in the preview dir:
+
+ -  src: a git worktree with the ref checked out
+ -  deploy, cache: the deploy directory and the blog cache of the preview
+ -  base: the commit of the main site the preview is based on
+
+a new preview starts with copies of the cache, the deploy directory and the
+other stored state of the main site, so only the differences of the ref to
+the main site are rendered by an update. the files of the cache and the
+deploy directory are hard linked, a file is replaced instead of changed when
+it is written again, see gitwig.common.break_hard_link. the highlight cache and the render
+timings are shared with the main site. if the main site was rendered again,
+the preview starts over from the new state of the main site.
+"""
+
+# global imports
+import copy
+import os
+import re
+import shutil
+import subprocess
+
+# local imports
+from . import cache
+from . import common
+
+SOURCE_DIR_NAME = "src"
+DEPLOY_DIR_NAME = "deploy"
+CACHE_DIR_NAME = "cache"
+BASE_FILE_NAME = "base"
+
+# characters not allowed in the directory name of a preview
+regex_unsafe = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+def link_tree(src_dir, dest_dir):
+    """ copies a directory tree by hard linking the files, a file is copied
+    if it can not be linked, e.g. on another file system
+    """
+    for dir_path, dir_names, file_names in os.walk(src_dir):
+        dest_path = os.path.normpath(os.path.join(dest_dir, 
+                                     os.path.relpath(dir_path, src_dir)))
+        if not os.path.isdir(dest_path):
+            os.makedirs(dest_path)
+        for file_name in file_names:
+            src_file = os.path.join(dir_path, file_name)
+            dest_file = os.path.join(dest_path, file_name)
+            try:
+                os.link(src_file, dest_file)
+            except OSError:
+                shutil.copy2(src_file, dest_file)
+
+
+class Preview(object):
+    """ a preview build of a git ref """
+
+    def __init__(self, config, ref):
+        """ initialization, the current working directory must be the site
+        directory
+        """
+        self.config = config
+        self.ref = ref
+        self.name = regex_unsafe.sub("-", ref).strip("-.") or "preview"
+        self.site_dir = os.getcwd()
+        self.preview_path = os.path.join(self.site_dir, config.preview_dir,
+                                         self.name)
+        self.source_dir = os.path.join(self.preview_path, SOURCE_DIR_NAME)
+        self.deploy_dir = os.path.join(self.preview_path, DEPLOY_DIR_NAME)
+        self.cache_dir = os.path.join(self.preview_path, CACHE_DIR_NAME)
+
+    def prepare(self):
+        """ checks out the ref and copies the state of the main site if
+        needed, returns the settings for rendering the preview
+
+        the current working directory is changed to the worktree of the ref
+        """
+        commit = self._resolve(self.ref)
+        base = self._main_commit()
+        if base != self._read_base():
+            self._reset(base)
+        self._checkout(commit)
+        os.chdir(self.source_dir)
+        common.log.info("preview: '%s' at %s, based on %s" %\
+                        (self.ref, commit[:7], (base or "nothing")[:7]))
+        return self.settings()
+
+    def settings(self):
+        """ returns a copy of the settings with the paths of the preview
+
+        the highlight cache and the render timings are shared with the main
+        site, delta bundles are not written for a preview
+        """
+        config = copy.copy(self.config)
+        config.deploy_dir = self.deploy_dir
+        config.cache_dir = self.cache_dir
+        for name in self._state_paths():
+            setattr(config, name, self._path(getattr(self.config, name)))
+        for name in ("highlight_cache_path", "render_timings_path"):
+            path = getattr(self.config, name)
+            if path:
+                setattr(config, name, os.path.join(self.site_dir, path))
+        config.checkpoint_dir = self._path(self.config.checkpoint_dir)
+        config.error_report_path = self._path(self.config.error_report_path)
+        config.link_report_path = self._path(self.config.link_report_path)
+        config.delta_bundle = ""
+        return config
+
+    def remove(self):
+        """ removes the worktree and the directory of the preview """
+        if os.path.isdir(self.source_dir):
+            subprocess.check_call(["git", "worktree", "remove", "--force",
+                                   self.source_dir])
+        if os.path.isdir(self.preview_path):
+            shutil.rmtree(self.preview_path)
+        common.log.info("preview: removed '%s'" % self.preview_path)
+
+    def _state_paths(self):
+        """ names of the settings with stored state copied from the main site
+        """
+        return ("search_cache_path", "link_graph_path", "media_cache_path",
+                "pending_path", "page_tree_path")
+
+    def _path(self, path):
+        """ returns a path in the preview directory """
+        return os.path.join(self.preview_path, os.path.basename(path))
+
+    def _resolve(self, ref):
+        """ returns the sha of the commit of a ref """
+        try:
+            output = subprocess.check_output(["git", "rev-parse", "--verify",
+                                              "-q", ref + "^{commit}"])
+        except subprocess.CalledProcessError:
+            raise common.PreviewError("unknown git ref '%s'" % ref)
+        return output.strip()
+
+    def _main_commit(self):
+        """ returns the last rendered commit of the main site or None """
+        try:
+            return cache.BlogCache.from_file(self.config.cache_dir).commit
+        except common.NeedsRebuildError:
+            return None
+
+    def _read_base(self):
+        """ returns the main site commit the preview is based on or None """
+        try:
+            file_handle = open(os.path.join(self.preview_path,
+                                            BASE_FILE_NAME))
+            base = file_handle.read().strip()
+            file_handle.close()
+        except IOError:
+            return None
+        return base
+
+    def _reset(self, base):
+        """ replaces the state of the preview with a copy of the main site
+
+        without a rendered main site the preview starts empty and the update
+        of the preview will issue a rebuild
+        """
+        common.log.info("preview: copying the main site to '%s'" %\
+                        self.preview_path)
+        for path in (self.deploy_dir, self.cache_dir):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+        if not os.path.isdir(self.preview_path):
+            os.makedirs(self.preview_path)
+        base_path = os.path.join(self.preview_path, BASE_FILE_NAME)
+        if base is None:
+            if os.path.isfile(base_path):
+                os.remove(base_path)
+            return
+        link_tree(self.config.cache_dir, self.cache_dir)
+        if os.path.isdir(self.config.deploy_dir):
+            link_tree(self.config.deploy_dir, self.deploy_dir)
+        for name in self._state_paths():
+            path = getattr(self.config, name)
+            if os.path.isfile(path):
+                shutil.copy2(path, self._path(path))
+            elif os.path.isfile(self._path(path)):
+                os.remove(self._path(path))
+        file_handle = open(base_path, "w")
+        file_handle.write(base + "\n")
+        file_handle.close()
+
+    def _checkout(self, commit):
+        """ checks out a commit in the worktree of the preview """
+        if os.path.isdir(self.source_dir):
+            subprocess.check_call(["git", "checkout", "-q", "--detach",
+                                   commit], cwd=self.source_dir)
+        else:
+            # a removed worktree might still be registered
+            subprocess.check_call(["git", "worktree", "prune"])
+            subprocess.check_call(["git", "worktree", "add", "-q", "--detach",
+                                   self.source_dir, commit])
@@ -1,26 +1,67 @@
 """ classes to determine what should be rendered and updating the cache
 
-there are two possibilities: 
+there are three possibilities: 
  -  Rebuild: renders everything
  -  Update: uses git to calculate what should be rendered
+ -  Retag: merges tags of blog posts and renders the affected pages
+
+all emit the items to render ordered by the priority classes in the
+render_priority setting, so the important pages are deployed first:
+ -  posts: changed blog posts, on a rebuild the posts on the blog index
+ -  blog, feed: the blog index and the feed
+ -  tags: the tag index and the tag pages
+ -  dates: the day, month and year indices
+ -  pages: the static pages
+ -  other_posts: all other blog posts
 """
 
 # global imports
 import codecs
+import collections
 import os
 
 # local imports
 from . import common
 from . import content
+from . import history
+
+# all priority classes, in the default order
+PRIORITY_CLASSES = ("posts", "blog", "feed", "tags", "dates", "pages",
+                    "other_posts")
+
+# stand ins for the entries of a git diff and for an old git blob, used for
+# the changes found by a reconciliation of the cache
+BlobChange = collections.namedtuple("BlobChange", "a_blob b_blob")
+OldBlob = collections.namedtuple("OldBlob", "path")
 
 
 class Renderset(object):
     """ Base class for all renderset types """
 
-    def __init__(self, config, cache):
-        """ initialization """
+    def __init__(self, config, cache, converter=None):
+        """ initialization 
+        
+        converter:
+            optional callable to convert the excerpts of blog posts, see 
+            gitwig.deploy.MarkdownConverter
+        """
         self.config = config
         self.cache = cache
+        self.converter = converter
+        # ids of the blog posts in the "posts" priority class
+        self.priority_posts = set()
+        # last modification times of source files from the git history
+        self.modified = dict()
+        # items that could not be loaded, as (id, message) tuples
+        self.errors = []
+        # optional gitwig.schedule.PendingQueue, future blog posts are added
+        # to it instead of the cache
+        self.pending = None
+        # optional gitwig.pagetree.PageTree, the static pages are added to it
+        self.page_tree = None
+        # new fingerprints of the indices to render by item key, stored in 
+        # the cache when the index is rendered, see rendered
+        self.fingerprints = dict()
     
     def items_to_delete(self):
         """ returns an iterable of all items that should be deleted """
@@ -29,14 +70,128 @@ class Renderset(object):
     def items_to_render(self):
         """ returns an iterable of all items that should be rendered """
         return set()
+    
+    def _update_meta(self, blog_post):
+        """ precomputes the excerpt and reading data of a blog post """
+        blog_post.update_meta(self.converter, self.config.excerpt_blocks, 
+                              self.config.words_per_minute)
+    
+    def _is_pending(self, blog_post):
+        """ checks if a blog post is scheduled and queues it """
+        if self.pending is None:
+            return False
+        if not self.pending.is_future(blog_post):
+            self.pending.remove(blog_post.id)
+            return False
+        self.pending.add(blog_post)
+        return True
+    
+    def _tag_feed(self, tag):
+        """ returns the feed of a tag, without content """
+        feed = content.TagFeed(tag)
+        feed.number_of_posts = self.config.posts_in_feed
+        return feed
+    
+    def _fragments(self):
+        """ returns the shared fragments with content, if enabled """
+        if not self.config.fragments:
+            return []
+        return [content.TagCloud.from_cache(cache=self.cache),
+                content.MonthArchive.from_cache(cache=self.cache)]
+    
+    def _set_related(self, blog_post):
+        """ sets the related blog posts and, if enabled, the previous and next
+        blog post from the cache
+        """
+        blog_post.set_related_from_cache(self.cache)
+        if self.config.post_navigation:
+            blog_post.set_neighbors_from_cache(self.cache)
+    
+    def _report_error(self, id, error):
+        """ records an item that could not be loaded """
+        message = "%s: %s" % (type(error).__name__, error)
+        common.log.warn("renderset: could not load '%s', %s" % (id, message))
+        self.errors.append( (id, message) )
+    
+    def _set_updated(self, item):
+        """ sets the updated header from the git history, if known 
+        
+        the times of static pages not changed in this run are taken from the
+        cache
+        """
+        updated = self.modified.get(item.id)
+        if updated is None and isinstance(item, content.StaticPage):
+            updated = self.cache.page_times.get(item.id)
+        if updated is not None:
+            item.headers["updated"] = updated
+    
+    def _store_page_times(self):
+        """ stores the modification times of the static pages in the cache """
+        page_dir = self.config.page_dir.rstrip("/") + "/"
+        for path, updated in self.modified.iteritems():
+            if path.startswith(page_dir):
+                self.cache.page_times[path] = updated
+    
+    def _index_body(self):
+        """ returns True if all indices show the bodies of their blog posts,
+        None to use the shows_body flag of an index
+        """
+        return True if self.config.index_shows_body else None
+    
+    def rendered(self, item):
+        """ stores the new fingerprint of a rendered index in the cache
+        
+        an index that failed to render keeps its old fingerprint, so it is 
+        not skipped as unchanged by the next update
+        """
+        fingerprint = self.fingerprints.pop(common.item_key(item), None)
+        if fingerprint is not None:
+            self.cache.set_fingerprint(item, fingerprint)
+    
+    def priorities(self):
+        """ returns the priority classes in the order they are rendered
+        
+        classes missing in the render_priority setting are rendered last
+        """
+        priorities = []
+        for name in self.config.render_priority or []:
+            if name not in PRIORITY_CLASSES:
+                common.log.warn("renderset: unknown priority class '%s'" %\
+                                name)
+            elif name not in priorities:
+                priorities.append(name)
+        priorities.extend(n for n in PRIORITY_CLASSES if n not in priorities)
+        return priorities
+    
+    def priority_class(self, item):
+        """ returns the name of the priority class of an item """
+        if isinstance(item, content.BlogPost):
+            if item.id in self.priority_posts:
+                return "posts"
+            return "other_posts"
+        elif isinstance(item, content.StaticPage):
+            return "pages"
+        elif isinstance(item, content.BlogIndex):
+            return "blog"
+        elif isinstance(item, (content.TagIndex, content.TagPage, 
+                               content.TagFeed, content.TagCloud)):
+            return "tags"
+        elif isinstance(item, content.FeedIndex):
+            return "feed"
+        return "dates"
         
 
 class Rebuild(Renderset):
     """ class for rendering all blog posts and static pages """
     
-    def __init__(self, config, cache):
+    def __init__(self, config, cache, converter=None):
         """ initialization """
-        super(Rebuild, self).__init__(config, cache)
+        super(Rebuild, self).__init__(config, cache, converter)
+        # optional callable, called without arguments every 
+        # checkpoint_interval loaded blog posts and after all are loaded
+        self.checkpoint = None
+        # the static pages, if they are read before rendering
+        self.static_pages = None
     
     def items_to_render(self):
         """ iterable of all items that should be rendered 
@@ -44,25 +199,130 @@ class Rebuild(Renderset):
         this is implemented as a generator method.
         """
         config = self.config
-        # find and emit all static pages
-        for page_path in common.walk(config.page_dir, config.source_exts):
-            yield content.StaticPage.from_file(page_path)
-        # find and emit all blog posts, adds these to the cache
+        if config.updated_from_git:
+            self.modified = history.modified_times([config.blog_dir, 
+                                                    config.page_dir])
+            self.cache.page_times = dict()
+            self._store_page_times()
+        # find all blog posts and add these to the cache, the indices need
+        # a complete cache. posts in the cache of a resumed rebuild are 
+        # not read again
+        if config.streaming_rebuild:
+            self.cache.use_body_cache(config.body_cache_size)
+        loaded = 0
         for posting_path in common.walk(config.blog_dir, config.source_exts):
-            blog_post = content.BlogPost.from_file(posting_path)
-            self.cache.add(blog_post)
-            yield blog_post
-        # rebuild the cache indices for the related content pages
-        self.cache.build_indices()
-        # base indizes
+            if posting_path in self.cache:
+                continue
+            try:
+                blog_post = self._load_blog_post(posting_path)
+                if self._is_pending(blog_post):
+                    continue
+                self._update_meta(blog_post)
+                # in streaming mode, the cache will drop the body of the post
+                self.cache.add(blog_post)
+            except Exception, e:
+                # a broken blog post should not stop the rebuild
+                self._report_error(posting_path, e)
+                self.cache.failed[posting_path] = None
+                continue
+            loaded += 1
+            if self.checkpoint and loaded % config.checkpoint_interval == 0:
+                self.checkpoint()
+        if self.checkpoint and loaded:
+            self.checkpoint()
+        # the page tree must be complete before any item is rendered
+        self.static_pages = None
+        if self.page_tree is not None:
+            self.static_pages = list(self._read_static_pages())
+            for page in self.static_pages:
+                self.page_tree.set_page(page)
+        # the cache indices are up to date, build the related posts
+        self.cache.build_related(config.related_posts)
+        # the posts on the blog index are the most important ones
+        self.priority_posts = set(self.cache.sorted_ids[:config.posts_in_blog])
+        # emit the items of each priority class, the items are created only
+        # when they are needed
+        sources = {
+            "posts": self._posts(priority=True),
+            "blog": self._base_indices(content.BlogIndex),
+            "feed": self._base_indices(content.FeedIndex),
+            "tags": self._tag_indices(),
+            "dates": self._date_indices(),
+            "pages": self._static_pages(),
+            "other_posts": self._posts(priority=False) }
+        for name in self.priorities():
+            common.log.debug("renderset: rendering priority class '%s'" %\
+                             name)
+            for item in sources[name]:
+                if item.is_index:
+                    # the fingerprints are stored for later updates
+                    self.fingerprints[common.item_key(item)] = \
+                        item.fingerprint(self.cache, self._index_body())
+                yield item
+    
+    def _load_blog_post(self, posting_path):
+        """ reads a blog post and the sha of its git blob from a file """
+        file_handle = open(posting_path, "rb")
+        data = file_handle.read()
+        file_handle.close()
+        blog_post = content.BlogPost(posting_path)
+        blog_post.parse_content(codecs.decode(data, "utf-8"))
+        blog_post.meta["blob"] = common.git_blob_sha(data)
+        self._set_updated(blog_post)
+        return blog_post
+    
+    def _static_pages(self):
+        """ generator of all static pages, read before if there is a tree """
+        if self.static_pages is not None:
+            return iter(self.static_pages)
+        return self._read_static_pages()
+    
+    def _read_static_pages(self):
+        """ generator of all static pages read from the page directory """
+        config = self.config
+        for page_path in common.walk(config.page_dir, config.source_exts):
+            try:
+                page = content.StaticPage.from_file(page_path)
+            except Exception, e:
+                self._report_error(page_path, e)
+                continue
+            self._set_updated(page)
+            yield page
+    
+    def _posts(self, priority):
+        """ generator of the blog posts in or not in the "posts" class """
+        # newest first
+        for id in self.cache.sorted_ids:
+            if (id in self.priority_posts) == priority:
+                blog_post = self.cache.get(id)
+                self._set_related(blog_post)
+                yield blog_post
+    
+    def _base_indices(self, index_class):
+        """ generator of the blog index or the feed """
         pinb, pinf = self.config.posts_in_blog, self.config.posts_in_feed
-        yield content.BlogIndex.from_cache(None, self.cache, pinb)
-        yield content.FeedIndex.from_cache(None, self.cache, pinf)
+        if index_class is content.BlogIndex:
+            yield content.BlogIndex.from_cache(None, self.cache, pinb)
+        else:
+            yield content.FeedIndex.from_cache(None, self.cache, pinf)
+    
+    def _tag_indices(self):
+        """ generator of the tag index and all tag pages """
         yield content.TagIndex.from_cache(cache=self.cache)
-        # tag pages
         for content_id in self.cache.tags:
             yield content.TagPage.from_cache(content_id, self.cache)
-        # date indizes
+        if self.config.tag_feeds:
+            for content_id in self.cache.tags:
+                feed = self._tag_feed(content_id)
+                feed.set_content_from_cache(self.cache)
+                yield feed
+        if self.config.fragments:
+            yield content.TagCloud.from_cache(cache=self.cache)
+    
+    def _date_indices(self):
+        """ generator of all date indices """
+        if self.config.fragments:
+            yield content.MonthArchive.from_cache(cache=self.cache)
         for content_id in self.cache.days:
             yield content.DayIndex.from_cache(content_id, self.cache)
         for content_id in self.cache.months:
@@ -79,16 +339,40 @@ class Update(Renderset):
     raised
     """
     
-    def __init__(self, config, cache):
+    def __init__(self, config, cache, converter=None):
         """ initialization """
-        super(Update, self).__init__(config, cache)
+        super(Update, self).__init__(config, cache, converter)
         # storage for item to render or delete
         self.to_render = set()
         self.to_delete = set()
+        # ids and tags of changed blog posts, used to update related posts
+        self.touched_posts = set()
+        self.touched_tags = set()
+        # neighbors and displayed data of changed blog posts before and after
+        # the changes, by id, used to update the previous and next links
+        self.old_links = dict()
+        self.new_links = dict()
+        # set by reconcile, old blog posts missing in the cache are read from
+        # git then
+        self.reconciled = False
+        # ids of old versions of static pages, removed from the page tree if
+        # there is no new version
+        self.old_pages = set()
+        # old versions of blog posts removed from the cache, by id. they are
+        # added again if the new version can not be read
+        self.old_versions = dict()
+        # id of a blog post that could not be read before -> id of the old 
+        # version of the renamed post replaced in this update
+        self.renamed = dict()
+        # git tree of the updated commit, set by the workflow. static pages
+        # added by their dependencies are read from it
+        self.tree = None
     
     def items_to_render(self):
-        """ returns the storage of all items that should be rendered """
-        return self.to_render
+        """ returns all items that should be rendered, by priority """
+        order = dict( (name, i) for i, name in enumerate(self.priorities()) )
+        return sorted(self.to_render, 
+                      key=lambda item: order[self.priority_class(item)])
 
     def items_to_delete(self):
         """ returns the storage of all items that should be deleted """
@@ -103,13 +387,35 @@ class Update(Renderset):
             if old_git_item:
                 common.log.debug("renderset: found old git item '%s'" %\
                                  old_git_item.path)
-                self._process_item(old_items, old_git_item, is_old=True)
+                try:
+                    self._process_item(old_items, old_git_item, is_old=True)
+                except common.NeedsRebuildError:
+                    raise
+                except Exception, e:
+                    # an old version that can not be read had no pages
+                    common.log.info("renderset: skipping broken old version"\
+                                    " of '%s'" % old_git_item.path)
             if new_git_item:
                 common.log.debug("renderset: found new git item '%s'" %\
                                  new_git_item.path)
-                self._process_item(self.to_render, new_git_item, is_old=False)
-        # rebuild the cache indices for related items
-        self.cache.build_indices()
+                try:
+                    self._process_item(self.to_render, new_git_item, 
+                                       is_old=False)
+                except common.NeedsRebuildError:
+                    raise
+                except Exception, e:
+                    # a broken item is left out, its old version stays online,
+                    # also under the old path of a renamed item
+                    self._report_error(new_git_item.path, e)
+                    old_id = old_git_item and old_git_item.path
+                    old_id = self.renamed.get(old_id, old_id)
+                    for path in set([new_git_item.path, old_id]) - set([None]):
+                        self._keep_old_version(old_items, path)
+                    self._record_failed(new_git_item.path, old_id)
+        # the cache indices are updated, now the related posts can be patched
+        self._patch_related()
+        self._patch_neighbors()
+        self._patch_pages()
         for item in old_items:
             if item.is_index and item.is_in_cache(self.cache):
                 # old index items that are still in the cache and therefor have 
@@ -124,16 +430,250 @@ class Update(Renderset):
         for item in self.to_render:
             if item.is_index:
                 item.set_content_from_cache(self.cache)
+            elif isinstance(item, content.BlogPost):
+                self._set_related(item)
         # we need to add the basic indices to the things to render
         pinb, pinf = self.config.posts_in_blog, self.config.posts_in_feed
         blog = content.BlogIndex.from_cache(None, self.cache, pinb)
         feed = content.FeedIndex.from_cache(None, self.cache, pinf)
         tags = content.TagIndex.from_cache(cache=self.cache)
         self.to_render.update([blog, feed, tags])
+        # the fragments shared by all pages are only rendered if changed
+        self.to_render.update(self._fragments())
+        self._skip_unchanged_indices()
         # and an info
         common.log.info("renderset: %d items to delete" % len(self.to_delete))
         common.log.info("renderset: %d items to render" % len(self.to_render))
         
+    def _keep_old_version(self, old_items, id):
+        """ keeps the old version of an item whose new version can not be 
+        read, its pages are not deleted and a blog post stays in the cache
+        """
+        old_items.discard(content.StaticPage(id))
+        old_items.discard(content.BlogPost(id))
+        self.old_pages.discard(id)
+        posting = self.old_versions.pop(id, None)
+        if posting is not None:
+            self.cache.add(posting)
+            self.old_links.pop(id, None)
+    
+    def _record_failed(self, id, old_id=None):
+        """ records a blog post that could not be read and has no old 
+        version in the cache, so the next update does not expect it in the
+        cache. the old version of a renamed blog post kept online is 
+        replaced by the next version of the blog post
+        """
+        if not id.startswith(self.config.blog_dir) or id in self.cache:
+            return
+        if old_id == id or old_id not in self.cache:
+            old_id = None
+        self.cache.failed[id] = old_id
+    
+    def read_modified_times(self, since, until="HEAD"):
+        """ reads the modification times of the sources changed since a 
+        commit from the git history 
+        """
+        self.modified = history.modified_times([self.config.blog_dir,
+                                                self.config.page_dir], since,
+                                               until)
+        self._store_page_times()
+    
+    def reconcile(self, gitdiff, tree):
+        """ replaces the blog posts in a git diff by the differences of the
+        cache and a git tree
+        
+        the git blob shas stored in the cache are compared with the tree, 
+        missing, deleted and changed blog posts are returned as changes. 
+        other changes of the git diff are kept, old versions of blog posts 
+        missing in the cache are kept to delete their pages. the result can be
+        used with patch, so only the blog posts that differ are parsed.
+        """
+        self.reconciled = True
+        blog_dir = self.config.blog_dir.rstrip("/") + "/"
+        cached = self.cache.blobs()
+        changes = []
+        for diff in gitdiff:
+            paths = [b.path for b in (diff.a_blob, diff.b_blob) if b]
+            if not any(p.startswith(blog_dir) for p in paths):
+                changes.append(diff)
+            elif diff.b_blob and diff.b_blob.path not in cached:
+                changes.append(BlobChange(None, diff.b_blob))
+        blobs = dict()
+        try:
+            blog_tree = tree[self.config.blog_dir]
+        except KeyError:
+            blog_tree = []
+        else:
+            blog_tree = blog_tree.traverse()
+        for git_item in blog_tree:
+            if git_item.type == "blob" and \
+               common.is_source_file(git_item.path, self.config.source_exts):
+                blobs[git_item.path] = git_item
+        drift = 0
+        for path, git_item in blobs.iteritems():
+            if path not in cached:
+                changes.append(BlobChange(git_item, None))
+            elif cached[path] != git_item.hexsha:
+                changes.append(BlobChange(git_item, OldBlob(path)))
+            else:
+                continue
+            drift += 1
+        for id in cached:
+            if id not in blobs:
+                changes.append(BlobChange(None, OldBlob(id)))
+                drift += 1
+        common.log.info("renderset: %d blog posts differ from the cache" %\
+                        drift)
+        if self.config.updated_from_git and drift:
+            # the posts might have changed before the last rendered commit
+            paths = [c.a_blob.path for c in changes 
+                     if isinstance(c, BlobChange) and c.a_blob]
+            if paths:
+                self.modified.update(history.modified_times(paths))
+        return changes
+    
+    def patch_media(self, page_keys):
+        """ adds the items referencing changed media files, see _add_items """
+        self._add_items(page_keys)
+        common.log.info("renderset: %d items to render after media changes" %\
+                        len(self.to_render))
+    
+    def _add_items(self, page_keys):
+        """ adds items to render
+        
+        the items are given as keys, see gitwig.common.item_key. items that
+        are not found any more are ignored
+        """
+        pinb, pinf = self.config.posts_in_blog, self.config.posts_in_feed
+        number_of_posts = {"BlogIndex": pinb, "FeedIndex": pinf, 
+                           "TagFeed": pinf}
+        for class_name, id in page_keys:
+            if class_name == "StaticPage":
+                try:
+                    git_item = self.tree[id]
+                except KeyError:
+                    continue
+                item = content.StaticPage(id)
+                item.parse_content(codecs.decode(git_item.data_stream.read(), 
+                                                 "utf-8"))
+                self._set_updated(item)
+            elif class_name == "BlogPost":
+                if id not in self.cache:
+                    continue
+                item = self.cache.get(id)
+                self._set_related(item)
+            else:
+                item = getattr(content, class_name)(id)
+                if not item.is_in_cache(self.cache):
+                    continue
+                if class_name in number_of_posts:
+                    item.set_content_from_cache(self.cache, 
+                                                number_of_posts[class_name])
+                else:
+                    item.set_content_from_cache(self.cache)
+            if item not in self.to_render and item not in self.to_delete:
+                self.to_render.add(item)
+    
+    def _skip_unchanged_indices(self):
+        """ removes indices that would display the same data as before """
+        for item in list(self.to_render):
+            if not item.is_index:
+                continue
+            fingerprint = self.cache.changed_fingerprint(item, 
+                                                         self._index_body())
+            if fingerprint is None:
+                common.log.debug("renderset: skipping unchanged index '%s'" %\
+                                 (item.id,))
+                self.to_render.discard(item)
+            else:
+                self.fingerprints[common.item_key(item)] = fingerprint
+        for item in self.to_delete:
+            if item.is_index:
+                self.cache.drop_fingerprint(item)
+    
+    def _patch_related(self):
+        """ updates the related posts of all posts sharing a changed tag 
+        
+        only blog posts with a changed list of related posts are rendered
+        """
+        candidates = self.cache.related_candidates(self.touched_tags)
+        candidates.update(self.touched_posts)
+        changed = self.cache.update_related(candidates, 
+                                            self.config.related_posts)
+        for id in changed:
+            if id in self.cache:
+                self.to_render.add(self.cache.get(id))
+        common.log.debug("renderset: %d posts with changed related posts" %\
+                         len(changed))
+
+    def due_changes(self, gitdiff, tree):
+        """ returns the changes for publishing the due pending blog posts 
+        
+        the blog posts are read from the git tree like new blog posts. posts
+        changed in the git diff are handled by it. due posts missing in the 
+        tree are dropped.
+        """
+        if self.pending is None:
+            return []
+        changed = set(b.path for diff in gitdiff 
+                      for b in (diff.a_blob, diff.b_blob) if b)
+        changes = []
+        for id in self.pending.due():
+            if id in changed:
+                continue
+            self.pending.remove(id)
+            try:
+                changes.append(BlobChange(tree[id], None))
+            except KeyError:
+                common.log.warn("renderset: pending '%s' not found" % id)
+        common.log.info("renderset: publishing %d due blog posts" %\
+                        len(changes))
+        return changes
+    
+    def _patch_neighbors(self):
+        """ adds the blog posts whose previous or next post has changed 
+        
+        the old and new neighbors of an added, removed or re-dated blog post 
+        are rendered, and the neighbors of a blog post with a changed title
+        """
+        changed = set()
+        for id in set(self.old_links) | set(self.new_links):
+            old_neighbors, old_data = self.old_links.get(id, ((), None))
+            new_neighbors, new_data = self.new_links.get(id, ((), None))
+            if old_data == new_data:
+                changed.update(set(old_neighbors) ^ set(new_neighbors))
+            else:
+                changed.update(old_neighbors)
+                changed.update(new_neighbors)
+        for id in changed:
+            if id is not None and id in self.cache:
+                self.to_render.add(self.cache.get(id))
+        common.log.debug("renderset: %d posts with changed neighbors" %\
+                         len(changed))
+    
+    def _patch_pages(self):
+        """ forgets deleted static pages, removes them from the page tree and 
+        adds the items that looked up a changed node of the tree
+        """
+        new_ids = set(item.id for item in self.to_render 
+                      if isinstance(item, content.StaticPage))
+        deleted = self.old_pages - new_ids
+        for id in deleted:
+            self.cache.page_times.pop(id, None)
+        if self.page_tree is None:
+            return
+        for id in deleted:
+            self.page_tree.remove_page(id)
+        changed = self.page_tree.changed
+        if changed:
+            self._add_items(self.page_tree.pages_depending(changed))
+        common.log.debug("renderset: %d changed nodes of the page tree" %\
+                         len(changed))
+    
+    def _link_data(self, posting):
+        """ returns the data of a blog post displayed by a link to it """
+        return (posting.headers["created"], posting.headers["title"])
+
     def _process_item(self, storage, git_item, is_old):
         """ chooses how a git item should be processed
         
@@ -170,31 +710,200 @@ class Update(Renderset):
             # if it is a new or updated page, read its content from the git blob
             utf8_content = codecs.decode(git_item.data_stream.read(), "utf-8")
             page.parse_content(utf8_content)
+            self._set_updated(page)
+            if self.page_tree is not None:
+                self.page_tree.set_page(page)
+        else:
+            self.old_pages.add(page.id)
         return [page]
         
     def _process_blog_post(self, git_item, is_old):
         """ processes a changed blog post and it's related indices 
         
-        will raise a NeedsRebuildError if a deleted blog post or an old version
+        will raise a CacheDriftError if a deleted blog post or an old version
         of a blog post is not found in the cache.
         """
+        navigation = self.config.post_navigation
+        if is_old and self.pending is not None and \
+           git_item.path in self.pending:
+            # a scheduled blog post has no pages yet
+            self.pending.remove(git_item.path)
+            return []
+        if is_old and git_item.path in self.cache.failed:
+            # a blog post that could not be read has no pages, but the old 
+            # version of a renamed post might be online
+            kept = self.cache.failed.pop(git_item.path)
+            if kept is None or kept not in self.cache:
+                return []
+            self.renamed[git_item.path] = kept
+            git_item = OldBlob(kept)
         if is_old:
             # the item is deleted or an old version
+            neighbors = None
+            if navigation and git_item.path in self.cache:
+                neighbors = self.cache.neighbors(git_item.path)
             posting = self.cache.pop(git_item.path, None)
-            if not posting:
-                raise common.NeedsRebuildError('"%s" not in cache' %\
-                                                git_item.path)
+            if posting is not None:
+                self.old_versions[posting.id] = posting
+            if neighbors is not None:
+                self.old_links[posting.id] = (neighbors, 
+                                              self._link_data(posting))
+            if not posting and not self.reconciled:
+                raise common.CacheDriftError('"%s" not in cache' %\
+                                             git_item.path)
+            elif not posting:
+                # the old version is read to find its pages and indices
+                posting = self._read_blog_post(git_item)
         else:
             # if it is a new or updated blog post, read its content from the git 
             # blob and add it to the cache
-            posting = content.BlogPost(git_item.path)
-            utf8_content = codecs.decode(git_item.data_stream.read(), "utf-8")
-            posting.parse_content(utf8_content)
+            posting = self._read_blog_post(git_item)
+            if self._is_pending(posting):
+                return []
+            self._set_updated(posting)
+            self._update_meta(posting)
             self.cache.add(posting)
+            if navigation:
+                self.new_links[posting.id] = (self.cache.neighbors(posting.id),
+                                              self._link_data(posting))
         # calculate the related date and tag indices of the blog post
         day_id = common.date_tuple(posting)
         day = content.DayIndex(day_id)
         month = content.MonthIndex(day_id[:2])
         year = content.YearIndex(day_id[:1])
+        self.touched_posts.add(posting.id)
+        if not is_old:
+            self.priority_posts.add(posting.id)
+        self.touched_tags.update(posting.headers["tags"])
         tags = [content.TagPage(tag) for tag in posting.headers["tags"]]
+        if self.config.tag_feeds:
+            tags.extend(self._tag_feed(tag) for tag in posting.headers["tags"])
         return [posting, day, month, year] + tags
+    
+    def _read_blog_post(self, git_item):
+        """ reads a blog post from a git blob """
+        posting = content.BlogPost(git_item.path)
+        utf8_content = codecs.decode(git_item.data_stream.read(), "utf-8")
+        posting.parse_content(utf8_content)
+        posting.meta["blob"] = git_item.hexsha
+        return posting
+
+
+class Retag(Update):
+    """ class for merging tags by rewriting the tags headers of blog posts
+    
+    the sources are rewritten first, after these are committed patch reads 
+    them into the cache. only the retagged blog posts, blog posts with other
+    related posts, the tag pages and feeds of the new tag and the tag index 
+    are rendered, the pages of the old tags are deleted. the date indices, 
+    the blog index and the feed are not rendered again.
+    """
+    
+    def __init__(self, config, cache, converter=None):
+        """ initialization """
+        super(Retag, self).__init__(config, cache, converter)
+        self.old_tags = set()
+        self.new_tag = None
+        # ids of the rewritten blog posts in the cache
+        self.retagged = []
+    
+    def rewrite(self, old_tags, new_tag):
+        """ replaces the old tags by the new tag in the sources of the blog 
+        posts, returns the paths of the rewritten files
+        
+        the tags are taken from the cache, scheduled blog posts are rewritten
+        too. a source file with uncommitted changes is not rewritten.
+        """
+        self.new_tag = new_tag.lower()
+        self.old_tags = set(tag.lower() for tag in old_tags) 
+        self.old_tags.discard(self.new_tag)
+        blobs = self.cache.blobs()
+        ids = self.cache.related_candidates(self.old_tags)
+        paths = []
+        for id in sorted(ids):
+            try:
+                self._rewrite_blog_post(id, blobs[id])
+            except Exception, e:
+                self._report_error(id, e)
+                continue
+            self.retagged.append(id)
+            paths.append(id)
+        for id in sorted(self.pending.posts if self.pending else ()):
+            try:
+                if self._rewrite_blog_post(id):
+                    paths.append(id)
+            except Exception, e:
+                self._report_error(id, e)
+        common.log.info("renderset: retagged %d blog posts" % len(paths))
+        return paths
+    
+    def patch(self):
+        """ reads the rewritten blog posts into the cache and calculates what 
+        should be rendered or deleted
+        """
+        for id in self.retagged:
+            old = self.cache.pop(id)
+            file_handle = open(id, "rb")
+            data = file_handle.read()
+            file_handle.close()
+            posting = content.BlogPost(id)
+            posting.parse_content(codecs.decode(data, "utf-8"))
+            # the body did not change, so the excerpt is still valid
+            posting.meta = dict(old.meta)
+            posting.meta["blob"] = common.git_blob_sha(data)
+            self._set_updated(posting)
+            self.cache.add(posting)
+            self.to_render.add(posting)
+        # the old tags of blog posts that could not be rewritten stay
+        for tag in self.old_tags:
+            pages = [content.TagPage(tag)]
+            if self.config.tag_feeds:
+                pages.append(self._tag_feed(tag))
+            if tag in self.cache.tags:
+                self.to_render.update(pages)
+            else:
+                self.to_delete.update(pages)
+        if self.retagged:
+            self.to_render.add(content.TagPage(self.new_tag))
+            if self.config.tag_feeds:
+                self.to_render.add(self._tag_feed(self.new_tag))
+        # only blog posts sharing the merged tags can have other related posts
+        candidates = self.cache.related_candidates(self.old_tags | 
+                                                   set([self.new_tag]))
+        changed = self.cache.update_related(candidates, 
+                                            self.config.related_posts)
+        for id in changed:
+            self.to_render.add(self.cache.get(id))
+        for item in self.to_render:
+            if item.is_index:
+                item.set_content_from_cache(self.cache)
+            else:
+                self._set_related(item)
+        self.to_render.add(content.TagIndex.from_cache(cache=self.cache))
+        self.to_render.update(self._fragments())
+        self._skip_unchanged_indices()
+        common.log.info("renderset: %d items to delete" % len(self.to_delete))
+        common.log.info("renderset: %d items to render" % len(self.to_render))
+    
+    def _rewrite_blog_post(self, id, blob=None):
+        """ rewrites the tags header of a blog post source file 
+        
+        returns False if the blog post has none of the old tags. raises a 
+        ValueError if the file does not match the git blob sha from the cache
+        """
+        file_handle = open(id, "rb")
+        data = file_handle.read()
+        file_handle.close()
+        if blob is not None and common.git_blob_sha(data) != blob:
+            raise ValueError("the file has uncommitted changes")
+        # the source is read again, the cached headers might be changed by
+        # the git history
+        source = content.BlogPost(id)
+        source.parse_content(codecs.decode(data, "utf-8"))
+        tags = source.headers["tags"] or set()
+        if not tags & self.old_tags:
+            return False
+        tags = (tags - self.old_tags) | set([self.new_tag])
+        source.headers["tags"] = sorted(tags)
+        source.write(id)
+        return True
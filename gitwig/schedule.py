@@ -0,0 +1,95 @@
+""" scheduled publishing of blog posts with a created date in the future
+
+future blog posts are not added to the cache, they are kept in a pending
+queue stored as a small json file mapping the ids of the blog posts to their
+created date. a run publishes the blog posts that became due since the last
+run. checking the queue for due blog posts only reads this file, so it can be
+done every minute.
+"""
+
+# global imports
+import datetime
+import json
+
+# local imports
+from . import common
+
+# format of the dates in the queue file, sortable as a string
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def now():
+    """ returns the current local time as a string in the DATE_FORMAT """
+    return datetime.datetime.now().strftime(DATE_FORMAT)
+
+
+class PendingQueue(object):
+    """ blog posts waiting for their created date """
+
+    def __init__(self):
+        """ initialization """
+        # blog post id -> created date as a string in the DATE_FORMAT
+        self.posts = dict()
+
+    def __contains__(self, id):
+        """ checks if a blog post is pending """
+        return id in self.posts
+
+    def __len__(self):
+        """ the number of pending blog posts """
+        return len(self.posts)
+
+    def is_future(self, blog_post):
+        """ checks if a blog post should not be published yet """
+        created = blog_post.headers.get("created")
+        return created is not None and created.strftime(DATE_FORMAT) > now()
+
+    def add(self, blog_post):
+        """ adds a future blog post to the queue """
+        created = blog_post.headers["created"].strftime(DATE_FORMAT)
+        common.log.info("schedule: '%s' is published at %s" %\
+                        (blog_post.id, created))
+        self.posts[blog_post.id] = created
+
+    def remove(self, id):
+        """ removes a blog post from the queue """
+        self.posts.pop(id, None)
+
+    def due(self):
+        """ returns the ids of the blog posts that should be published """
+        current = now()
+        return sorted(id for id, created in self.posts.iteritems()
+                      if created <= current)
+
+    def next_due(self):
+        """ returns the next created date in the queue or None """
+        return min(self.posts.itervalues()) if self.posts else None
+
+    def write(self, pending_path):
+        """ writes the queue to a file """
+        file_handle = open(pending_path, "wb")
+        json.dump(self.posts, file_handle, indent=1, sort_keys=True)
+        file_handle.close()
+
+    def load(self, pending_path):
+        """ loads the queue from a file, an empty queue if there is none 
+        
+        will raise a gitwig.common.NeedsRebuildError if the file is broken
+        """
+        try:
+            file_handle = open(pending_path, "rb")
+            self.posts = dict(json.load(file_handle))
+            file_handle.close()
+        except IOError:
+            self.posts = dict()
+        except (ValueError, TypeError):
+            # a rebuild finds the pending posts again
+            raise common.NeedsRebuildError("could not load the pending posts"\
+                                           " from '%s'" % pending_path)
+
+    @classmethod
+    def from_file(cls, pending_path):
+        """ returns an instance and loads the queue from a file """
+        instance = cls()
+        instance.load(pending_path)
+        return instance
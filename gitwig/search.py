@@ -0,0 +1,269 @@
+""" static client side search index for blog posts
+
+the index is written as json files to the search directory in the deploy
+directory:
+
+ -  meta.json: the parameters needed by a client to find the right files
+ -  docs/<block>.json: a list of [url, title, date] rows for the documents
+    with the numbers block * docs_per_block and following. deleted documents
+    are set to null, their numbers will be reused
+ -  terms/<shard>.json: a mapping of terms to a list of [document, score]
+    pairs, best score first. the name of a shard is the hex encoded utf-8
+    representation of the first characters of the term
+
+the mapping of blog posts to document numbers, shards and terms is stored in a
+separate pickle file, so an update only has to rewrite the shards that
+contain terms of changed or deleted blog posts.
+"""
+
+# global imports
+import hashlib
+import json
+import os
+import re
+try:
+    import cPickle as pickle
+except ImportError:
+    # fallback
+    import pickle
+
+# local imports
+from . import common
+from . import content
+
+# number of leading characters of a term used for the name of its shard
+SHARD_PREFIX_LENGTH = 2
+# number of document rows in one docs file
+DOCS_PER_BLOCK = 1000
+# minimal length of a term to be indexed
+MIN_TERM_LENGTH = 2
+# additional scores for terms found in the title or the tags
+TITLE_SCORE = 5
+TAG_SCORE = 5
+
+# regular expression for extracting terms
+regex_terms = re.compile(r"\w+", re.UNICODE)
+
+
+def extract_terms(text):
+    """ generator of all lower case terms in a text """
+    for term in regex_terms.findall(text.lower()):
+        if len(term) >= MIN_TERM_LENGTH:
+            yield term
+
+def shard_name(term):
+    """ returns the name of the shard file a term is stored in """
+    return term[:SHARD_PREFIX_LENGTH].encode("utf-8").encode("hex")
+
+
+class SearchIndex(object):
+    """ sharded inverted index of blog posts written as static json files """
+
+    def __init__(self, config, delta=None):
+        """ initialization 
+        
+        delta:
+            optional gitwig.delta.DeltaBundle recording the changed files
+        """
+        self.config = config
+        self.delta = delta
+        self.search_dir = os.path.join(config.deploy_dir, config.search_dir)
+        # blog post id -> document number
+        self.documents = dict()
+        # document number -> [url, title, date]
+        self.rows = dict()
+        # document number -> (digest of the indexed data, set of shard names)
+        self.fingerprints = dict()
+        # document number -> set of the indexed terms, a removal only touches
+        # the postings of these terms
+        self.terms = dict()
+        # document numbers that can be reused
+        self.free = list()
+        # shard name -> term -> document number -> score, only loaded shards
+        self.shards = dict()
+        # shards and doc blocks that need to be written
+        self.dirty_shards = set()
+        self.dirty_blocks = set()
+        # a fresh index does not need to read existing shards
+        self._read_shards = False
+
+    def add(self, item):
+        """ adds or replaces a blog post in the index
+
+        other content items are ignored. if the indexed data of the blog post
+        did not change, no shard will be touched.
+        """
+        if not isinstance(item, content.BlogPost):
+            return
+        row = self._document_row(item)
+        terms = self._score_terms(item)
+        digest = hashlib.md5(repr( (row, sorted(terms.iteritems())) ))
+        digest = digest.hexdigest()
+        docnum = self.documents.get(item.id)
+        if docnum is not None and self.fingerprints[docnum][0] == digest:
+            common.log.debug("search: '%s' is unchanged" % item.id)
+            return
+        self.remove(item)
+        common.log.debug("search: indexing '%s'" % item.id)
+        if self.free:
+            docnum = self.free.pop()
+        else:
+            # every document number in use has a row or is free to reuse
+            docnum = len(self.rows)
+        self.documents[item.id] = docnum
+        self.rows[docnum] = row
+        self.dirty_blocks.add(docnum // DOCS_PER_BLOCK)
+        shard_names = set()
+        for term, score in terms.iteritems():
+            name = shard_name(term)
+            self._get_shard(name).setdefault(term, dict())[docnum] = score
+            shard_names.add(name)
+        self.dirty_shards.update(shard_names)
+        self.fingerprints[docnum] = (digest, shard_names)
+        self.terms[docnum] = set(terms)
+
+    def remove(self, item):
+        """ removes a blog post from the index, other items are ignored """
+        if not isinstance(item, content.BlogPost):
+            return
+        docnum = self.documents.pop(item.id, None)
+        if docnum is None:
+            return
+        common.log.debug("search: removing '%s'" % item.id)
+        digest, shard_names = self.fingerprints.pop(docnum)
+        for term in self.terms.pop(docnum):
+            shard = self._get_shard(shard_name(term))
+            postings = shard.get(term, {})
+            postings.pop(docnum, None)
+            if not postings:
+                shard.pop(term, None)
+        self.dirty_shards.update(shard_names)
+        del self.rows[docnum]
+        self.dirty_blocks.add(docnum // DOCS_PER_BLOCK)
+        self.free.append(docnum)
+
+    def _document_row(self, blog_post):
+        """ returns the data shown for a search result """
+        url = "/" + "/".join(blog_post.get_url_parts())
+        created = blog_post.headers["created"]
+        date = created.strftime("%Y-%m-%d") if created else None
+        return [url, blog_post.headers["title"], date]
+
+    def _score_terms(self, blog_post):
+        """ returns a dict with the indexed terms of a blog post and scores """
+        terms = dict()
+        body = common.strip_markdown(blog_post.get_body())
+        for term in extract_terms(body):
+            terms[term] = terms.get(term, 0) + 1
+        for term in extract_terms(blog_post.headers["title"] or ""):
+            terms[term] = terms.get(term, 0) + TITLE_SCORE
+        for term in extract_terms(" ".join(blog_post.headers["tags"] or [])):
+            terms[term] = terms.get(term, 0) + TAG_SCORE
+        return terms
+
+    def _get_shard(self, name):
+        """ returns a shard, reading it from the search directory if needed """
+        if name not in self.shards:
+            shard = dict()
+            path = os.path.join(self.search_dir, "terms", name + ".json")
+            if self._read_shards and os.path.isfile(path):
+                file_handle = open(path, "rb")
+                for term, postings in json.load(file_handle).iteritems():
+                    shard[term] = dict( (d, s) for d, s in postings )
+                file_handle.close()
+            self.shards[name] = shard
+        return self.shards[name]
+
+    def write(self, search_cache_path):
+        """ writes the changed json files and the pickled state """
+        common.log.info("search: writing %d shards and %d doc blocks ..." %\
+                        (len(self.dirty_shards), len(self.dirty_blocks)))
+        self._write_json(("meta.json",), {
+            "shard_prefix_length": SHARD_PREFIX_LENGTH,
+            "docs_per_block": DOCS_PER_BLOCK,
+            "min_term_length": MIN_TERM_LENGTH })
+        for name in self.dirty_shards:
+            shard = self.shards[name]
+            data = dict()
+            for term, postings in shard.iteritems():
+                ranked = sorted(postings.iteritems(), key=lambda p: -p[1])
+                data[term] = [list(p) for p in ranked]
+            self._write_json(("terms", name + ".json"), data)
+        for block in self.dirty_blocks:
+            first = block * DOCS_PER_BLOCK
+            rows = [self.rows.get(i) for i in xrange(first, 
+                                                     first + DOCS_PER_BLOCK)]
+            # trailing rows of unused document numbers are not needed
+            while rows and rows[-1] is None:
+                rows.pop()
+            self._write_json(("docs", "%d.json" % block), rows)
+        self.dirty_shards, self.dirty_blocks = set(), set()
+        state = (self.documents, self.rows, self.fingerprints, self.terms,
+                 self.free)
+        file_handle = open(search_cache_path, "wb")
+        pickle.dump(state, file_handle, pickle.HIGHEST_PROTOCOL)
+        file_handle.close()
+        common.log.info("search: ... done")
+
+    def _write_json(self, parts, data):
+        """ writes data as compact json to the search directory
+
+        empty data will remove the file
+        """
+        path = os.path.join(self.search_dir, *parts)
+        if not any(data):
+            if os.path.isfile(path):
+                os.remove(path)
+                if self.delta is not None:
+                    self.delta.add_deleted(path)
+            return
+        dir_path = os.path.dirname(path)
+        if not os.path.isdir(dir_path):
+            os.makedirs(dir_path)
+        common.break_hard_link(path)
+        file_handle = open(path, "wb")
+        json.dump(data, file_handle, separators=(",", ":"))
+        file_handle.close()
+        if self.delta is not None:
+            self.delta.add_written(path)
+
+    def clear(self):
+        """ removes all json files of the index from the search directory
+
+        used on a rebuild, so no stale shards are left over
+        """
+        for sub_dir in ("terms", "docs"):
+            dir_path = os.path.join(self.search_dir, sub_dir)
+            if os.path.isdir(dir_path):
+                for file_name in os.listdir(dir_path):
+                    os.remove(os.path.join(dir_path, file_name))
+                    if self.delta is not None:
+                        self.delta.add_deleted(os.path.join(dir_path, 
+                                                            file_name))
+
+    def load(self, search_cache_path):
+        """ loads the pickled state of the index from a file
+
+        will raise a gitwig.common.NeedsRebuildError if the file could not be
+        opened or the data could not be unpickled
+        """
+        try:
+            common.log.info("search: loading from '%s' ..." %\
+                            search_cache_path)
+            file_handle = open(search_cache_path, "rb")
+            state = pickle.load(file_handle)
+            file_handle.close()
+            self.documents, self.rows, self.fingerprints, self.terms, \
+                self.free = state
+            self._read_shards = True
+            common.log.info("search: ... done")
+        except (IOError, ValueError, pickle.PickleError):
+            raise common.NeedsRebuildError("could not load search index "\
+                                           "from '%s'" % search_cache_path)
+
+    @classmethod
+    def from_file(cls, config, search_cache_path, delta=None):
+        """ returns an instance and loads the state from file in one go """
+        instance = cls(config, delta)
+        instance.load(search_cache_path)
+        return instance
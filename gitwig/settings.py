@@ -1,6 +1,7 @@
 """ some sensible defaults and loading of a settings file """
 
 import codecs
+import os
 import yaml
 
 from . import common
@@ -15,16 +16,131 @@ class Settings(object):
     media_dir =     "static/media"
     inbox_dir =     "_inbox"
     
-    cache_path = "cache.pickle"
+    cache_dir = "cache"
+    
+    # only one process at a time may render the site, the render daemon 
+    # listens on the socket for notifications, see gitwig.daemon
+    lock_path = "gitwig.lock"
+    daemon_socket = "gitwig.sock"
+    
+    # static search index, the search dir is relative to the deploy dir
+    search_index = False
+    search_dir = "search"
+    search_cache_path = "search.pickle"
+
+    # checking of internal links in the rendered pages: "" disables the check,
+    # "report" writes the broken links to the report file and "fail" will 
+    # also let the command fail. links starting with an ignored path like
+    # "/search/" are not checked
+    link_check = ""
+    link_graph_path = "links.pickle"
+    link_report_path = "links.txt"
+    link_check_ignore = []
+
+    # media files get urls with a version from their content, so they can be
+    # cached forever, the digests are stored in the media cache file
+    media_fingerprints = False
+    media_cache_path = "media.pickle"
+
+    # comments and whitespace are removed from the rendered pages, except in
+    # pre, code, textarea, script and style elements
+    minify = False
+
+    # every run writes a delta bundle to the delta dir for replicating the
+    # deploy dir: "list" only lists the changed files, "tar" or "dir" also 
+    # contain the files. only the last delta_keep bundles are kept. the 
+    # changes of a run failing the link check are held back in the held file
+    # and added to the next bundle
+    delta_bundle = ""
+    delta_dir = "deltas"
+    delta_keep = 50
+    delta_held_path = "delta-held.json"
+
+    # previews of other git refs are rendered to their own directories in the
+    # preview dir, see gitwig.preview
+    preview_dir = "previews"
+
+    # a rebuild writes a checkpoint every checkpoint_interval items, so an 
+    # interrupted rebuild of the same commit can resume. 0 disables this.
+    # items that could not be loaded or rendered are written to the report
+    checkpoint_interval = 200
+    checkpoint_dir = "checkpoint"
+    error_report_path = "errors.txt"
+
+    # the index templates show the complete bodies of the blog posts, so a
+    # changed body renders the indices showing the blog post again
+    index_shows_body = False
+
+    # feeds for every tag in tags/<tag>.xml, rendered with the feed template
+    tag_feeds = False
+
+    # number of characters of converted blog posts kept in memory with 
+    # tag_feeds, so a post in several feeds is converted only once. 0 
+    # disables this
+    conversion_memo_size = 4 * 1024 * 1024
+
+    # the average render times of the item types are stored in the timings
+    # file and used by the plan command, an empty path disables this
+    render_timings_path = "timings.json"
+
+    # a streaming rebuild does not keep the bodies of blog posts in memory,
+    # they are loaded through a cache holding at most body_cache_size chars
+    streaming_rebuild = False
+    body_cache_size = 4 * 1024 * 1024
+
+    # the order in which the items are rendered, see gitwig.renderset
+    render_priority = ["posts", "blog", "feed", "tags", "dates", "pages",
+                       "other_posts"]
+
+    # the updated header of blog posts and static pages is set to the time
+    # of the last commit changing them, read from the git history
+    updated_from_git = False
+
+    # blog posts know their previous and next blog post, an update renders
+    # the neighbors of added, removed and re-dated blog posts
+    post_navigation = False
+
+    # blog posts created in the future are kept in the pending file and 
+    # published by the first run after their created date, see the
+    # publish-due command
+    scheduled_publishing = False
+    pending_path = "pending.json"
+
+    # the tag cloud and the month archive are rendered as fragments to 
+    # fragments/tags.html and fragments/archive.html for server side or client
+    # side includes, with the templates in the fragments template directory.
+    # they are only rendered when the tags or months change
+    fragments = False
+
+    # the static pages are kept in a tree of sections, templates can use it
+    # as "pages" for navigation. an update renders the pages that looked up
+    # a changed part of the tree, see gitwig.pagetree
+    page_tree = False
+    page_tree_path = "pagetree.pickle"
 
     posts_in_blog = 25
     posts_in_feed = 50
+    related_posts = 5
+    
+    # precomputed data for blog posts: number of blocks in an excerpt and
+    # words per minute used for the reading time
+    excerpt_blocks = 1
+    words_per_minute = 200
 
     url_prefix =    "http://www.example.com"
     media_prefix =  "http://www.example.com/static/media"
     blog_title =    "my gitwig blog"
     author =        "myself"
     
+    # used by the gitwig command, see gitwig.cli
+    locale = ""
+    markdown_extensions = ["codehilite(linenums=True)"]
+    
+    # cache for code highlighted by the codehilite extension, an empty path
+    # disables the cache, the size is the maximum number of code blocks 
+    highlight_cache_path = "highlight.pickle"
+    highlight_cache_size = 10000
+    
     default_title = "untitled"
     default_tags =  "untagged"
     
@@ -50,3 +166,10 @@ class Settings(object):
         tmp_settings = yaml.load(file_handle)
         for key, value in tmp_settings.iteritems():
             setattr(self, key, value if value else "")
+        if "cache_path" in tmp_settings:
+            # the cache was a single file before it was split into shards
+            if "cache_dir" not in tmp_settings and self.cache_path:
+                self.cache_dir = os.path.splitext(self.cache_path)[0]
+            common.log.warn("settings: 'cache_path' is deprecated, the cache "\
+                            "is stored in the directory '%s' now, set "\
+                            "'cache_dir' instead" % self.cache_dir)
@@ -24,7 +24,7 @@ setup(
     include_package_data=True,
     zip_safe=False,
     install_requires=[
-        "markdown>=2.1",
+        "markdown>=2.6,<3.0",
         "Pygments>=1.5",
         "genshi>=0.6",
         "GitPython>=0.3.2.RC1",
@@ -32,6 +32,8 @@ setup(
     ],
     entry_points="""
     # -*- Entry points: -*-
+    [console_scripts]
+    gitwig = gitwig.cli:main
     """,
     # package_data={'': ['safeguard_logo.jpg']},
     